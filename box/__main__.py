@@ -1,8 +1,15 @@
 """Main module."""
 
-from command_ui import CommandUI
+import os
+import time
 
 
 if __name__ == '__main__':
+    start = time.perf_counter()
+    from command_ui import CommandUI
+
     com = CommandUI()
-    com.parse_args()
+    if os.environ.get("BOX_PROFILE_IMPORT"):
+        com.profile_startup(start,
+                            int(os.environ.get("BOX_STARTUP_BUDGET_MS", 50)))
+    com.parse_args(start)
@@ -0,0 +1,224 @@
+"""Asyncio interface of box, for services embedding it."""
+
+import asyncio
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from db_manager import DatabaseManager
+from facade import Facade
+from rows import Rows
+
+# errors of facade methods raised as BoxError
+FAILURES = (SystemExit, sqlite3.Error, ValueError)
+
+
+class BoxError(Exception):
+    """A box operation failed, with the message the command line shows."""
+
+
+def box_error(error):
+    """Return a BoxError for one of FAILURES."""
+    if isinstance(error, SystemExit):
+        return BoxError(error.code)
+    return BoxError(str(error))
+
+
+async def iter_in_thread(executor, produce, queue_size=256):
+    """Yield the items of produce(), run and read in an executor thread.
+
+    The queue is bounded so a slow consumer doesn't make the items pile
+    up in memory, the thread waits for room instead. Errors of the
+    thread, SystemExit included, are raised here. Closing the generator
+    stops the thread at its next item and waits for it.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    cancelled = threading.Event()
+
+    def put(kind, value=None):
+        asyncio.run_coroutine_threadsafe(queue.put((kind, value)),
+                                         loop).result()
+
+    def run():
+        try:
+            items = produce()
+            try:
+                for item in items:
+                    if cancelled.is_set():
+                        return
+                    put("item", item)
+            finally:
+                if hasattr(items, "close"):
+                    items.close()
+            put("done")
+        except (Exception, SystemExit) as error:
+            put("error", error)
+
+    producer = loop.run_in_executor(executor, run)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "done":
+                break
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        if not producer.done():
+            # the consumer left, let the producer finish
+            cancelled.set()
+            while not producer.done():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.001)
+
+
+class AsyncBox(object):
+    """Facade methods as coroutines returning python objects.
+
+    Database work runs on a bounded pool of threads, each keeping its
+    own connection open. Reads run concurrently, writes one at a time.
+    Use it as an async context manager, or await close when done.
+    """
+
+    def __init__(self, workers=4, queue_size=256):
+        """Constructor.
+
+        queue_size is how many found rows wait for an iter_find consumer
+        at most, the reading thread waits for room meanwhile.
+        """
+        self._facade = Facade()
+        # worker threads keep their connection open
+        self._executor = ThreadPoolExecutor(
+            workers, thread_name_prefix="box",
+            initializer=DatabaseManager().keep_open)
+        self._queue_size = queue_size
+        self._write_lock = None
+
+    async def __aenter__(self):
+        """Return the box."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Close the box."""
+        await self.close()
+
+    async def close(self):
+        """Wait for the work running and stop the threads."""
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._executor.shutdown)
+
+    async def _run(self, method, *args):
+        """Run a facade method in the pool, return its result.
+
+        Rows are read in the same thread, as they hold its connection.
+        """
+        def call():
+            try:
+                result = getattr(self._facade, method)(*args)
+                if isinstance(result, Rows):
+                    return list(result.dicts())
+                return result
+            except FAILURES as error:
+                raise box_error(error) from None
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, call)
+
+    async def _write(self, method, *args):
+        """Run a facade method that writes, one at a time."""
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            return await self._run(method, *args)
+
+    async def add_file(self, name, category, description=None, tags=None,
+                       attach=None):
+        """Add a file, storing the documents of attach, return its id."""
+        # the file manager appends to the tags
+        tags = list(tags) if tags else None
+        return await self._write("add_file", name, category, description,
+                                 tags, attach)
+
+    async def mod_file(self, file_id, name=None, category=None,
+                       description=None, tags=None, add_tags=None,
+                       rm_tags=None):
+        """Modify a file, return False if it doesn't exist."""
+        return await self._write("mod_file", file_id, name, category,
+                                 description, tags, add_tags, rm_tags)
+
+    async def rm_file(self, file_id):
+        """Remove a file."""
+        await self._write("rm_file", file_id)
+
+    async def execute(self, sql):
+        """Run a statement that changes the database."""
+        await self._write("execute", sql, False)
+
+    async def select(self, sql):
+        """Return the rows of a select as dicts."""
+        return await self._run("execute_rows", sql)
+
+    async def get_info(self, file_id):
+        """Return all info about a file as a dict, None if it's missing."""
+        return await self._run("info", file_id) or None
+
+    async def find(self, name=None, category=None, description=None,
+                   tags=None, limit=None, tag_mode="any", content=None,
+                   fuzzy=False, order_by=None, after=None):
+        """Return the found files as dicts, see Facade.find_rows."""
+        return await self._run("find_rows", name, category, description,
+                               tags, limit, tag_mode, 1, content, fuzzy,
+                               order_by, after)
+
+    async def find_page(self, limit, name=None, category=None,
+                        description=None, tags=None, tag_mode="any",
+                        content=None, fuzzy=False, order_by=None,
+                        after=None):
+        """Return up to limit found files as dicts, and the next cursor.
+
+        Pass the cursor as after to get the next page, it's None on the
+        last one.
+        """
+        return await self._run("find_page", name, category, description,
+                               tags, limit, tag_mode, 1, content, fuzzy,
+                               order_by, after)
+
+    async def iter_find(self, name=None, category=None, description=None,
+                        tags=None, limit=None, tag_mode="any", content=None,
+                        fuzzy=False, order_by=None, after=None):
+        """Yield the found files as dicts while they're read.
+
+        Leaving the loop early stops the read once the generator is
+        closed, wrap it in contextlib.aclosing to close it right away.
+        """
+        def found():
+            rows = self._facade.find_rows(
+                name, category, description, tags, limit, tag_mode, 1,
+                content, fuzzy, order_by, after)
+            try:
+                yield from rows.dicts()
+            finally:
+                rows.close()
+
+        stream = iter_in_thread(self._executor, found, self._queue_size)
+        try:
+            async for row in stream:
+                yield row
+        except FAILURES as error:
+            raise box_error(error) from None
+        finally:
+            await stream.aclose()
+
+    async def facets(self, name=None, category=None, description=None,
+                     tags=None, tag_mode="any", content=None, top=None):
+        """Return the files per category and per tag of the found files."""
+        return await self._run("facets", name, category, description, tags,
+                               tag_mode, content, top)
+
+    async def stats(self):
+        """Return how many files, categories and tags there are."""
+        return await self._run("stats")
@@ -0,0 +1,282 @@
+"""Benchmarks of box operations over a synthetic corpus."""
+
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from functools import partial
+
+from config import ConfigManager
+from db_manager import DatabaseManager
+from facade import Facade
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "po", "si", "de", "fa",
+             "gu", "be", "zo", "xi", "ha", "vo"]
+
+
+class Corpus(object):
+    """Reproducible synthetic collection of files."""
+
+    def __init__(self, files=10000, categories=20, tags=200,
+                 tags_per_file=3, desc_words=10, seed=0):
+        """Constructor."""
+        self.files = files
+        self.tags_per_file = min(tags_per_file, tags)
+        self.desc_words = desc_words
+        self._random = random.Random(seed)
+        self.categories = self._vocabulary(categories)
+        self.tags = self._vocabulary(tags)
+
+    def _vocabulary(self, size):
+        """Return size distinct words."""
+        words = set()
+        while len(words) < size:
+            words.add(self.word())
+        return sorted(words)
+
+    def word(self):
+        """Return a random word of two to four syllables."""
+        count = self._random.randint(2, 4)
+        return "".join(self._random.choice(SYLLABLES) for _ in range(count))
+
+    def words(self, count):
+        """Return count random words separated by spaces."""
+        return " ".join(self.word() for _ in range(count))
+
+    def record(self):
+        """Return a random file record."""
+        return {
+            "name": self.words(3),
+            "category": self._random.choice(self.categories),
+            "description": self.words(self.desc_words),
+            "tags": self._random.sample(self.tags, self.tags_per_file),
+        }
+
+    def records(self):
+        """Yield the records of the whole corpus."""
+        for _ in range(self.files):
+            yield self.record()
+
+    def choice(self, seq):
+        """Return a random element of seq."""
+        return self._random.choice(seq)
+
+    def file_id(self):
+        """Return the id of a random file of the corpus."""
+        return self._random.randint(1, self.files)
+
+
+def latency_summary(samples):
+    """Return throughput and latency percentiles of a list of seconds."""
+    samples = sorted(samples)
+    total = sum(samples)
+
+    def percentile(p):
+        index = max(int(round(p / 100.0 * len(samples))) - 1, 0)
+        return samples[index] * 1000
+
+    return {
+        "ops": len(samples),
+        "seconds": round(total, 6),
+        "ops_per_sec": round(len(samples) / total, 2) if total else None,
+        "latency_ms": {
+            "mean": round(total / len(samples) * 1000, 4),
+            "p50": round(percentile(50), 4),
+            "p90": round(percentile(90), 4),
+            "p99": round(percentile(99), 4),
+            "max": round(samples[-1] * 1000, 4),
+        },
+    }
+
+
+def peak_memory(call):
+    """Return the peak bytes allocated while running call."""
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@contextmanager
+def temporary_database():
+    """Point box to a new database in a temporary folder."""
+    config = ConfigManager()
+    saved = (config.database_folder, config.database_name,
+             config.database_path)
+    DatabaseManager().close()
+    with tempfile.TemporaryDirectory() as folder:
+        config.database_folder = folder + os.sep
+        config.database_name = "bench.sqlite3"
+        config.database_path = config.database_folder + config.database_name
+        try:
+            yield config.database_path
+        finally:
+            DatabaseManager().close()
+            (config.database_folder, config.database_name,
+             config.database_path) = saved
+
+
+class Benchmark(object):
+    """Runs scripted workloads through the facade."""
+
+    def __init__(self, corpus, ops=200, batch_size=1000, workers=(1, 2, 4),
+                 scan_ops=10):
+        """Constructor."""
+        self.corpus = corpus
+        self.ops = ops
+        self.batch_size = batch_size
+        self.workers = workers
+        self.scan_ops = scan_ops
+        self._facade = Facade()
+
+    def run(self):
+        """Run every workload in a temporary database, return a report."""
+        with temporary_database():
+            self._facade.init()
+            report = {
+                "corpus": {
+                    "files": self.corpus.files,
+                    "categories": len(self.corpus.categories),
+                    "tags": len(self.corpus.tags),
+                    "tags_per_file": self.corpus.tags_per_file,
+                    "desc_words": self.corpus.desc_words,
+                },
+                "environment": {
+                    "python": platform.python_version(),
+                    "sqlite": sqlite3.sqlite_version,
+                    "cpus": os.cpu_count(),
+                },
+                "import": self._bulk_add(),
+                "workloads": {},
+            }
+            workloads = report["workloads"]
+            workloads["add"] = self._measure(self._add)
+            workloads["find_name"] = self._measure(self._find_name)
+            workloads["find_desc"] = self._measure(self._find_desc)
+            workloads["find_tag"] = self._measure(self._find_tag)
+            workloads["find_category"] = self._measure(self._find_category)
+            workloads["show"] = self._measure(self._show)
+            workloads["mod"] = self._measure(self._mod)
+            workloads["sql"] = self._measure(self._sql)
+            workloads["facets"] = self._measure(self._facets)
+            report["scaling"] = self._scaling()
+            report["memory"] = self._memory()
+            workloads["rm"] = self._measure(self._rm)
+        return report
+
+    def _scaling(self):
+        """Time whole table reads split between each number of workers."""
+        scaling = {"scan_json": {}, "scan_rows": {}, "find_category": {}}
+        for workers in self.workers:
+            scaling["scan_json"][workers] = self._measure(
+                partial(self._scan_json, workers), self.scan_ops)
+            scaling["scan_rows"][workers] = self._measure(
+                partial(self._scan_rows, workers), self.scan_ops)
+            scaling["find_category"][workers] = self._measure(
+                partial(self._find_category, workers), self.scan_ops)
+        return scaling
+
+    def _memory(self):
+        """Peak bytes of holding every file as dicts and as tuple Rows."""
+        sql = "SELECT * FROM files"
+        find = (None, None, None, None)
+        memory = {}
+        for name, as_dicts, as_rows in (
+                ("sql_all", partial(self._facade.iter_execute, sql),
+                 partial(self._facade.execute_rows, sql)),
+                ("find_all", partial(self._facade.iter_find_file, *find),
+                 partial(self._facade.find_rows, *find))):
+            self._facade.clear_cache()
+            dicts = peak_memory(lambda: list(as_dicts()))
+            self._facade.clear_cache()
+            rows = peak_memory(lambda: list(as_rows()))
+            memory[name] = {"dicts_bytes": dicts, "rows_bytes": rows}
+        return memory
+
+    def _bulk_add(self):
+        """Load the corpus in batches, return the throughput."""
+        start = time.perf_counter()
+        rows = self._facade.file_manager.import_files(self.corpus.records(),
+                                                      self.batch_size)
+        elapsed = time.perf_counter() - start
+        return {
+            "rows": rows,
+            "seconds": round(elapsed, 6),
+            "rows_per_sec": round(rows / elapsed, 2) if elapsed else None,
+        }
+
+    def _measure(self, operation, ops=None):
+        """Time self.ops calls, operation returns each call ready to run."""
+        samples = []
+        for _ in range(ops or self.ops):
+            call = operation()
+            start = time.perf_counter()
+            call()
+            samples.append(time.perf_counter() - start)
+        return latency_summary(samples)
+
+    def _find(self, name=None, category=None, description=None, tags=None,
+              workers=1):
+        return list(self._facade.iter_find_file(name, category, description,
+                                                tags, workers=workers))
+
+    def _add(self):
+        record = self.corpus.record()
+        return partial(self._facade.add_file, record["name"],
+                       record["category"], record["description"],
+                       record["tags"])
+
+    def _find_name(self):
+        return partial(self._find, name=self.corpus.word())
+
+    def _find_desc(self):
+        return partial(self._find, description=self.corpus.word())
+
+    def _find_tag(self):
+        return partial(self._find, tags=[self.corpus.choice(self.corpus.tags)])
+
+    def _find_category(self, workers=1):
+        # cached results would hide the cost of the query
+        self._facade.clear_cache()
+        return partial(self._find,
+                       category=self.corpus.choice(self.corpus.categories),
+                       workers=workers)
+
+    def _show(self):
+        return partial(self._facade.get_info, self.corpus.file_id())
+
+    def _mod(self):
+        record = self.corpus.record()
+        return partial(self._facade.mod_file, self.corpus.file_id(), None,
+                       record["category"], None, record["tags"])
+
+    def _sql(self):
+        sql = ("SELECT category_name, count(*) AS files FROM files "
+               "GROUP BY category_name")
+        # iter_execute runs the query up to its first row, time that too
+        return lambda: list(self._facade.iter_execute(sql))
+
+    def _facets(self):
+        # the counter tables, against the group by of _sql
+        self._facade.clear_cache()
+        return self._facade.facets
+
+    def _scan_json(self, workers):
+        sql = "SELECT * FROM files WHERE desc LIKE '%{}%'".format(
+            self.corpus.choice(SYLLABLES))
+        return partial(self._facade.execute, sql, True, workers)
+
+    def _scan_rows(self, workers):
+        sql = "SELECT * FROM files WHERE desc LIKE '%{}%'".format(
+            self.corpus.choice(SYLLABLES))
+        return lambda: list(self._facade.iter_execute(sql, workers))
+
+    def _rm(self):
+        return partial(self._facade.rm_file, self.corpus.file_id())
@@ -0,0 +1,126 @@
+"""Content addressed store of attached documents."""
+
+import os
+import shutil
+import time
+
+# bytes read at a time, files are never read whole
+CHUNK_SIZE = 1024 * 1024
+# orphan blobs younger than this may belong to a file being added
+GC_GRACE_SECONDS = 3600
+
+
+class BlobStore(object):
+    """Documents stored once per content, named by their sha256.
+
+    Blobs live in folder/ab/cdef..., where abcdef... is the hash, and
+    the links named like the documents in folder/links/abcdef.../.
+    """
+
+    def __init__(self, folder):
+        """Constructor."""
+        self.folder = folder
+
+    def path(self, digest):
+        """Return the path of a blob."""
+        return os.path.join(self.folder, digest[:2], digest[2:])
+
+    def link(self, digest, name):
+        """Return a path called name linking to a blob.
+
+        Viewers go by the extension and blobs have none. Every blob has
+        one link folder, reused on every open. Return the blob path if
+        the link can't be made.
+        """
+        link = os.path.join(self.folder, "links", digest,
+                            os.path.basename(name))
+        if not os.path.lexists(link):
+            try:
+                os.makedirs(os.path.dirname(link), exist_ok=True)
+                os.symlink(self.path(digest), link)
+            except FileExistsError:
+                pass
+            except OSError:
+                return self.path(digest)
+        return link
+
+    def put(self, source):
+        """Copy a file into the store.
+
+        Return its hash, size and guessed mime type. A blob that is
+        already stored isn't copied again.
+        """
+        # slow to import, only adding documents needs them
+        import hashlib
+        import mimetypes
+        import tempfile
+
+        os.makedirs(self.folder, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    dst.write(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                # a recent mtime keeps gc away until it's referenced
+                os.utime(path)
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest, size, mimetypes.guess_type(source)[0]
+
+    def blobs(self):
+        """Yield the hash, path and size of every stored blob."""
+        if not os.path.isdir(self.folder):
+            return
+        for prefix in sorted(os.listdir(self.folder)):
+            folder = os.path.join(self.folder, prefix)
+            if len(prefix) != 2 or not os.path.isdir(folder):
+                continue
+            for rest in sorted(os.listdir(folder)):
+                path = os.path.join(folder, rest)
+                yield prefix + rest, path, os.path.getsize(path)
+
+    def gc(self, referenced, dry_run=False, grace=GC_GRACE_SECONDS):
+        """Remove the blobs whose hash isn't referenced.
+
+        Blobs and interrupted copies younger than grace seconds are kept,
+        they may belong to a file being added. Return how many blobs are,
+        or with dry_run would be, removed and their size.
+        """
+        limit = time.time() - grace
+        count = size = 0
+        for digest, path, blob_size in list(self.blobs()):
+            if digest in referenced or os.path.getmtime(path) > limit:
+                continue
+            if not dry_run:
+                os.unlink(path)
+            count += 1
+            size += blob_size
+        if not dry_run and os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                path = os.path.join(self.folder, name)
+                if name.endswith(".tmp") and os.path.getmtime(path) < limit:
+                    os.unlink(path)
+            self._remove_dangling_links()
+        return count, size
+
+    def _remove_dangling_links(self):
+        """Remove the link folders of removed blobs."""
+        links = os.path.join(self.folder, "links")
+        if not os.path.isdir(links):
+            return
+        for digest in os.listdir(links):
+            if not os.path.exists(self.path(digest)):
+                shutil.rmtree(os.path.join(links, digest))
@@ -0,0 +1,167 @@
+"""Cache of query results."""
+
+import atexit
+import json
+import os
+import threading
+
+from collections import OrderedDict
+
+from config import ConfigManager
+
+
+class Borg:
+    """Borg singleton pattern."""
+
+    _shared_state = {}
+
+    def __init__(self):
+        """Constructor."""
+        self.__dict__ = self._shared_state
+
+
+def cache_key(method, *params, exact=()):
+    """Return a key of the normalised parameters of a query.
+
+    Text is matched case insensitively, so it's lowered and its spaces
+    collapsed, and lists of tags are sorted. exact parameters, like
+    cursors, are kept as they are.
+    """
+    key = [method]
+    for param in params:
+        if isinstance(param, str):
+            param = " ".join(param.lower().split())
+        elif isinstance(param, (list, tuple)):
+            param = sorted(set(p.lower() for p in param))
+        key.append(param)
+    key.extend(exact)
+    return json.dumps(key)
+
+
+class QueryCache(Borg):
+    """LRU cache of query results for one generation of the database.
+
+    Results are dropped when the database generation changes, which
+    every write bumps. The cache can be saved next to the database so
+    repeated commands benefit from it.
+    """
+
+    _init_lock = threading.Lock()
+
+    def __init__(self):
+        """Constructor."""
+        Borg.__init__(self)
+        with self._init_lock:
+            if "_lock" in self.__dict__:
+                return
+            self._config = ConfigManager()
+            self.enabled = self._config.query_cache
+            self.max_entries = self._config.query_cache_entries
+            self.max_rows = self._config.query_cache_max_rows
+            self._entries = OrderedDict()
+            self._generation = None
+            self._path = None
+            self._dirty = False
+            self.hits = 0
+            self.misses = 0
+            # set last, it marks the shared state as ready
+            self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        """Return the cached result of a key, None if there is none."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load()
+            self._check_generation(generation)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                result = self._entries[key]
+            else:
+                self.misses += 1
+                result = None
+            self._dirty = True
+            return result
+
+    def put(self, key, generation, result):
+        """Cache the result of a key, evicting the least recently used."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._load()
+            self._check_generation(generation)
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def clear(self):
+        """Drop every result and reset the counters."""
+        with self._lock:
+            self._load()
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self._dirty = True
+        self.save()
+
+    def stats(self):
+        """Return the cache counters."""
+        with self._lock:
+            self._load()
+            return {
+                "enabled": self.enabled,
+                "persistent": self._config.query_cache_persist,
+                "generation": self._generation and self._generation[-1],
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _check_generation(self, generation):
+        """Drop the results of another generation or database.
+
+        generation is the database id and write generation, a database
+        created again at the same path has another id.
+        """
+        generation = [self._config.database_path] + list(generation)
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def _load(self):
+        """Load the saved cache of the current database, once."""
+        path = self._config.database_folder + "query_cache.json"
+        if not self._config.query_cache_persist or self._path == path:
+            return
+        self._path = path
+        atexit.register(self.save)
+        try:
+            with open(path) as cache_file:
+                saved = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        self._generation = saved["generation"]
+        self._entries = OrderedDict(saved["entries"])
+        self.hits = saved["hits"]
+        self.misses = saved["misses"]
+
+    def save(self):
+        """Save the cache to disk if it's persistent and changed."""
+        with self._lock:
+            if not self._dirty or not self._path:
+                return
+            saved = {
+                "generation": self._generation,
+                "entries": list(self._entries.items()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "w") as cache_file:
+                json.dump(saved, cache_file)
+            os.replace(tmp_path, self._path)
+            self._dirty = False
@@ -0,0 +1,143 @@
+"""Client of the box daemon."""
+
+import json
+import os
+import socket
+
+from rows import Rows
+
+
+class RemoteFacade(object):
+    """Facade methods answered by a running box daemon.
+
+    Errors answered by the daemon exit like the facade does.
+    """
+
+    def __init__(self, sock):
+        """Constructor."""
+        self._sock = sock
+        self._stream = sock.makefile("rwb")
+
+    @classmethod
+    def connect(cls, path):
+        """Return a client of the daemon, None if it isn't running."""
+        if not os.path.exists(path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock)
+
+    def close(self):
+        """Close connection to the daemon."""
+        self._stream.close()
+        self._sock.close()
+
+    def _send(self, method, args):
+        """Send a request."""
+        request = {"method": method, "args": list(args)}
+        self._stream.write((json.dumps(request) + "\n").encode())
+        self._stream.flush()
+
+    def _receive(self):
+        """Return the next message, exit if it's an error."""
+        line = self._stream.readline()
+        if not line:
+            exit("ERROR: box daemon closed the connection.")
+        message = json.loads(line)
+        if "error" in message:
+            error = message["error"]
+            # facade exits already carry their prefix
+            exit(error if error.startswith("ERROR: ") else "ERROR: " + error)
+        return message
+
+    def _call(self, method, *args):
+        """Call a method returning a value."""
+        self._send(method, args)
+        return self._receive()["result"]
+
+    def _rows(self, method, *args):
+        """Call a method yielding rows, and their columns first if any."""
+        self._send(method, args)
+        while True:
+            message = self._receive()
+            if "columns" in message:
+                yield message["columns"]
+            elif "row" in message:
+                yield message["row"]
+            else:
+                return
+
+    def add_file(self, name, category_name, desc=None, tags=None,
+                 attach=None):
+        """Add a new file, storing the documents of attach, return its id."""
+        return self._call("add_file", name, category_name, desc, tags,
+                          attach)
+
+    def rm_file(self, file_id):
+        """Remove a file."""
+        return self._call("rm_file", file_id)
+
+    def mod_file(self, file_id, name, category, description, tags,
+                 add_tags=None, rm_tags=None):
+        """Modify file, return False if it doesn't exist."""
+        return self._call("mod_file", file_id, name, category, description,
+                          tags, add_tags, rm_tags)
+
+    def get_info(self, file_id):
+        """Get all info about a file."""
+        return self._call("get_info", file_id)
+
+    def cache_stats(self):
+        """Return the query cache counters."""
+        return self._call("cache_stats")
+
+    def clear_cache(self):
+        """Drop cached query results."""
+        return self._call("clear_cache")
+
+    def stats(self):
+        """Return how many files, categories and tags there are."""
+        return self._call("stats")
+
+    def facets(self, name=None, category=None, description=None, tags=None,
+               tag_mode="any", content=None, top=None):
+        """Return the files per category and per tag of the found files."""
+        return self._call("facets", name, category, description, tags,
+                          tag_mode, content, top)
+
+    def iter_find_file(self, name, category, description, tags, limit=None,
+                       tag_mode="any", workers=1, content=None, fuzzy=False,
+                       order_by=None, after=None):
+        """Find files yielding them one by one."""
+        return self._rows("iter_find_file", name, category, description,
+                          tags, limit, tag_mode, workers, content, fuzzy,
+                          order_by, after)
+
+    def find_rows(self, name, category, description, tags, limit=None,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
+        """Find files, return their Rows."""
+        return Rows.headed(self._rows("find_rows", name, category,
+                                      description, tags, limit, tag_mode,
+                                      workers, content, fuzzy, order_by,
+                                      after))
+
+    def find_page(self, name, category, description, tags, limit,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
+        """Return up to limit found files as dicts, and the next cursor."""
+        return tuple(self._call("find_page", name, category, description,
+                                tags, limit, tag_mode, workers, content,
+                                fuzzy, order_by, after))
+
+    def explain_find_file(self, name, category, description, tags,
+                          limit=None, tag_mode="any", content=None,
+                          fuzzy=False, order_by=None, after=None):
+        """Return the query plan of a find."""
+        return self._rows("explain_find_file", name, category, description,
+                          tags, limit, tag_mode, content, fuzzy, order_by,
+                          after)
@@ -1,26 +1,86 @@
 """Command line user interface."""
 
 import argparse
-import json
+import os
+import sys
+import time
 
-from facade import Facade
-from utilities import format_dict_list
-from config import ConfigManager
+# modules that only database commands should load
+HEAVY_MODULES = ("sqlite3", "json", "csv", "configparser", "config",
+                 "db_manager", "file_manager", "facade", "parallel",
+                 "indexer", "extractors", "blob_store",
+                 "rows", "utilities", "fuzzy", "vocabulary")
+
+
+# fields of rm and mod --where filters, and their find argument
+WHERE_FIELDS = {
+    "name": "name",
+    "desc": "description",
+    "category": "category",
+    "tag": "tags",
+    "tag-mode": "tag_mode",
+    "content": "content",
+}
+
+# commands answered by box serve when it's running
+SERVED_COMMANDS = ("add", "rm", "mod", "find", "show", "cache", "facets",
+                   "stats")
 
 
 class CommandUI(object):
-    """Handles commands."""
+    """Handles commands.
+
+    The facade and the configuration are loaded the first time a command
+    needs them, so help and argument errors don't import or read them.
+    """
 
     def __init__(self):
         """Constructor."""
         self._parser = self._build_parser()
-        self._facade = Facade()
-        self._config = ConfigManager()
+        self._facade_instance = None
+
+    @property
+    def _facade(self):
+        """Facade, imported on first use."""
+        if self._facade_instance is None:
+            from tracing import TRACER
+
+            with TRACER.phase("load facade"):
+                from facade import Facade
+                self._facade_instance = Facade()
+        return self._facade_instance
+
+    def _served_facade(self):
+        """Client of box serve if it's running, the facade otherwise.
+
+        Traced commands always run here, to trace their statements.
+        """
+        from tracing import TRACER
+
+        if not os.environ.get("BOX_NO_DAEMON") and not TRACER.enabled:
+            from client import RemoteFacade
+            remote = RemoteFacade.connect(self._config.socket_path)
+            if remote:
+                return remote
+        return self._facade
+
+    @property
+    def _config(self):
+        """Configuration, read on first use."""
+        from config import ConfigManager
+        return ConfigManager()
 
     @staticmethod
     def _build_parser():
         """Build parser."""
         parser = argparse.ArgumentParser()
+        parser.add_argument('--profile',
+                            action='store_true',
+                            help='time the phases and sql statements of the '
+                                 'command, print a summary to stderr')
+        parser.add_argument('--trace',
+                            metavar='FILE',
+                            help='like --profile, write a json trace to FILE')
         subparsers = parser.add_subparsers(help='commands', dest='command')
 
         parser_add = subparsers.add_parser('add', help='add a new file')
@@ -38,16 +98,52 @@ class CommandUI(object):
                                 type=str,
                                 nargs='+',
                                 help='file\'s tags')
+        parser_add.add_argument('-a', '--attach',
+                                nargs='+',
+                                help='documents to store with the file')
+
+        parser_import = subparsers.add_parser(
+            'import', help='import files from csv or json lines')
+        parser_import.add_argument('path',
+                                   nargs='?',
+                                   default='-',
+                                   help='file to import, stdin by default')
+        parser_import.add_argument('-f', '--format',
+                                   choices=['csv', 'jsonl'],
+                                   help='input format, guessed from the '
+                                        'file extension by default')
+        parser_import.add_argument('-b', '--batch-size',
+                                   type=int,
+                                   default=1000,
+                                   help='files inserted per transaction')
 
         parser_rm = subparsers.add_parser('rm', help='rm a file')
-        parser_rm.add_argument('file_id',
-                               type=int,
-                               help='file id')
+        parser_rm.add_argument('file_ids',
+                               nargs='*',
+                               help='file id, ranges like 10-20 or - to '
+                                    'read them from stdin')
+        parser_rm.add_argument('-w', '--where',
+                               action='append',
+                               help='filter like find does, '
+                                    'field=value with field one of ' +
+                                    ", ".join(WHERE_FIELDS))
+        parser_rm.add_argument('--dry-run',
+                               action="store_true",
+                               help='only count the files')
 
         parser_mod = subparsers.add_parser('mod', help='modify a file')
-        parser_mod.add_argument('file_id',
-                                type=int,
-                                help='file id')
+        parser_mod.add_argument('file_ids',
+                                nargs='*',
+                                help='file id, ranges like 10-20 or - to '
+                                     'read them from stdin')
+        parser_mod.add_argument('-w', '--where',
+                                action='append',
+                                help='filter like find does, '
+                                     'field=value with field one of ' +
+                                     ", ".join(WHERE_FIELDS))
+        parser_mod.add_argument('--dry-run',
+                                action="store_true",
+                                help='only count the files')
         parser_mod.add_argument('-n', '--name',
                                 nargs='+',
                                 help='file name')
@@ -61,6 +157,14 @@ class CommandUI(object):
                                 type=str,
                                 nargs='+',
                                 help='file\'s tags')
+        parser_mod.add_argument('--add-tags',
+                                type=str,
+                                nargs='+',
+                                help='tags to add')
+        parser_mod.add_argument('--rm-tags',
+                                type=str,
+                                nargs='+',
+                                help='tags to remove')
 
         parser_sql = subparsers.add_parser('sql', help='type custom sql')
         parser_sql.add_argument('sql',
@@ -69,6 +173,21 @@ class CommandUI(object):
         parser_sql.add_argument('-s', '--select',
                                 action="store_true",
                                 help='is a select query')
+        parser_sql.add_argument('-j', '--json',
+                                action="store_true",
+                                help='export json')
+        parser_sql.add_argument('--jsonl',
+                                action="store_true",
+                                help='export json lines, one row per line')
+        parser_sql.add_argument('--columns',
+                                nargs='+',
+                                help='columns to show')
+        parser_sql.add_argument('--workers',
+                                type=int,
+                                default=1,
+                                help='run a select once per range of file '
+                                     'ids, in parallel, if the ranges give '
+                                     'the same rows')
 
         parser_find = subparsers.add_parser('find', help='find files')
         parser_find.add_argument('-n', '--name',
@@ -84,71 +203,692 @@ class CommandUI(object):
                                  type=str,
                                  nargs='+',
                                  help='file\'s tags')
+        parser_find.add_argument('-x', '--content',
+                                 nargs='+',
+                                 help='text of the attached documents')
+        parser_find.add_argument('-m', '--tag-mode',
+                                 choices=['any', 'all', 'regex'],
+                                 default='any',
+                                 help='match files with any or all of the '
+                                      'tags, or use them as a regex')
+        parser_find.add_argument('-f', '--fuzzy',
+                                 action="store_true",
+                                 help='match the name by similarity, '
+                                      'tolerating typos, best first')
+        parser_find.add_argument('-l', '--limit',
+                                 type=int,
+                                 help='only return the first results, and '
+                                      'the cursor of the next page')
+        parser_find.add_argument('-o', '--order-by',
+                                 choices=['id', 'name', 'category', 'rank'],
+                                 help='sort by this and then by id, ranked '
+                                      'searches are sorted by rank and the '
+                                      'rest by id by default')
+        parser_find.add_argument('-a', '--after',
+                                 help='only return files sorted after this '
+                                      'file id or next page cursor')
+        parser_find.add_argument('--explain',
+                                 action="store_true",
+                                 help='show the query plan instead')
         parser_find.add_argument('-j', '--json',
                                  action="store_true",
                                  help='export json')
+        parser_find.add_argument('--jsonl',
+                                 action="store_true",
+                                 help='export json lines, one row per line')
+        parser_find.add_argument('--columns',
+                                 nargs='+',
+                                 help='columns to show')
+        parser_find.add_argument('--workers',
+                                 type=int,
+                                 default=1,
+                                 help='read ranges of file ids in parallel '
+                                      'threads')
+        parser_find.add_argument('--facets',
+                                 action="store_true",
+                                 help='also count the found files per '
+                                      'category and tag')
+
+        parser_facets = subparsers.add_parser(
+            'facets', help='count files per category and tag')
+        parser_facets.add_argument('-n', '--name',
+                                   nargs='+',
+                                   help='only files with this name')
+        parser_facets.add_argument('-c', '--category',
+                                   type=str,
+                                   help='only files of this category')
+        parser_facets.add_argument('-d', '--description',
+                                   nargs='+',
+                                   help='only files with this description')
+        parser_facets.add_argument('-t', '--tags',
+                                   type=str,
+                                   nargs='+',
+                                   help='only files with these tags')
+        parser_facets.add_argument('-x', '--content',
+                                   nargs='+',
+                                   help='only files with this text in their '
+                                        'documents')
+        parser_facets.add_argument('-m', '--tag-mode',
+                                   choices=['any', 'all', 'regex'],
+                                   default='any',
+                                   help='match files with any or all of the '
+                                        'tags, or use them as a regex')
+        parser_facets.add_argument('--top',
+                                   type=int,
+                                   help='only the most common categories '
+                                        'and tags')
+        parser_facets.add_argument('-j', '--json',
+                                   action="store_true",
+                                   help='export json')
+
+        subparsers.add_parser(
+            'stats', help='count files, categories and tags')
 
         subparsers.add_parser('init', help='initial db setup')
 
+        parser_migrate = subparsers.add_parser(
+            'migrate', help='upgrade the database schema')
+        parser_migrate.add_argument('-a', '--analyze',
+                                    action="store_true",
+                                    help='refresh query planner statistics')
+
+        parser_dump = subparsers.add_parser(
+            'dump', help='export the database as sql')
+        parser_dump.add_argument('-o', '--output',
+                                 help='file to write, stdout by default')
+        parser_dump.add_argument('-z', '--gzip',
+                                 action="store_true",
+                                 help='compress with gzip, the default for '
+                                      'outputs ending in .gz')
+
+        parser_backup = subparsers.add_parser(
+            'backup', help='copy the database while it\'s in use')
+        parser_backup.add_argument('path',
+                                   help='file of the copy')
+        parser_backup.add_argument('-p', '--pages',
+                                   type=int,
+                                   default=256,
+                                   help='pages copied per step, writers '
+                                        'wait for one step at most')
+        parser_backup.add_argument('-q', '--quiet',
+                                   action="store_true",
+                                   help='don\'t show progress')
+
         parser_show = subparsers.add_parser('show', help='show file info')
         parser_show.add_argument('file_id',
                                  type=int,
                                  help='file id')
 
+        parser_open = subparsers.add_parser(
+            'open', help='open the documents attached to a file')
+        parser_open.add_argument('file_id',
+                                 type=int,
+                                 help='file id')
+        parser_open.add_argument('name',
+                                 nargs='?',
+                                 help='only the document with this name')
+        parser_open.add_argument('-p', '--path',
+                                 action="store_true",
+                                 help='print where they are stored instead')
+
+        parser_gc = subparsers.add_parser(
+            'gc', help='remove documents of removed files')
+        parser_gc.add_argument('--dry-run',
+                               action="store_true",
+                               help='only count them')
+        parser_gc.add_argument('--min-age',
+                               type=int,
+                               default=3600,
+                               help='seconds since a document was stored '
+                                    'before it can be removed, it may '
+                                    'belong to a file being added')
+
+        parser_index = subparsers.add_parser(
+            'index', help='index the text of the attached documents')
+        parser_index.add_argument('-w', '--workers',
+                                  type=int,
+                                  help='extraction processes, one per cpu '
+                                       'by default')
+        parser_index.add_argument('--retry-failed',
+                                  action="store_true",
+                                  help='try the failed documents again')
+        parser_index.add_argument('--status',
+                                  action="store_true",
+                                  help='show the backlog and throughput '
+                                       'instead')
+
+        parser_cache = subparsers.add_parser(
+            'cache', help='show query cache counters')
+        parser_cache.add_argument('--clear',
+                                  action="store_true",
+                                  help='drop cached results')
+
+        parser_completion = subparsers.add_parser(
+            'completion', help='print a shell completion script')
+        parser_completion.add_argument('shell',
+                                       nargs='?',
+                                       choices=['bash', 'zsh'],
+                                       help='shell of the script, bash by '
+                                            'default')
+        parser_completion.add_argument('--refresh',
+                                       action="store_true",
+                                       help='write the completed categories '
+                                            'and tags again instead, after '
+                                            'changing the database by hand')
+
+        parser_serve = subparsers.add_parser(
+            'serve', help='run a daemon answering commands on a socket')
+        parser_serve.add_argument('-s', '--socket',
+                                  help='socket path, socket_path in .boxrc '
+                                       'by default')
+        parser_serve.add_argument('-w', '--workers',
+                                  type=int,
+                                  default=4,
+                                  help='threads running database work')
+
+        parser_bench = subparsers.add_parser(
+            'bench', help='benchmark operations on a synthetic corpus')
+        parser_bench.add_argument('--files',
+                                  type=int,
+                                  default=10000,
+                                  help='files in the corpus')
+        parser_bench.add_argument('--categories',
+                                  type=int,
+                                  default=20,
+                                  help='distinct categories')
+        parser_bench.add_argument('--tags',
+                                  type=int,
+                                  default=200,
+                                  help='distinct tags')
+        parser_bench.add_argument('--tags-per-file',
+                                  type=int,
+                                  default=3,
+                                  help='tags of every file')
+        parser_bench.add_argument('--desc-words',
+                                  type=int,
+                                  default=10,
+                                  help='words of every description')
+        parser_bench.add_argument('--ops',
+                                  type=int,
+                                  default=200,
+                                  help='operations per workload')
+        parser_bench.add_argument('--workers',
+                                  type=int,
+                                  nargs='+',
+                                  default=[1, 2, 4],
+                                  help='workers of the parallel reads')
+        parser_bench.add_argument('--scan-ops',
+                                  type=int,
+                                  default=10,
+                                  help='operations per parallel read')
+        parser_bench.add_argument('--seed',
+                                  type=int,
+                                  default=0,
+                                  help='random seed of the corpus')
+        parser_bench.add_argument('-o', '--output',
+                                  help='write the json report to a file')
+
         return parser
 
+    def profile_startup(self, start, budget_ms=50):
+        """Print to stderr the time spent before running a command.
+
+        start is a time.perf_counter() taken before importing this module.
+        """
+        try:
+            # help and argument errors exit here
+            self._control(self._parser.parse_args())
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+            print("box startup: {:.1f} ms, budget {} ms{}".format(
+                elapsed_ms, budget_ms,
+                " (OVER BUDGET)" if elapsed_ms > budget_ms else ""),
+                file=sys.stderr)
+            print("heavy modules loaded: " + (", ".join(loaded) or "none"),
+                  file=sys.stderr)
+
     def test_parser(self, test_args=None):
         """Test parser."""
         args = self._control(self._parser.parse_args(args=test_args))
         return args
 
-    def parse_args(self):
-        """Call Facades function based on args.."""
+    def parse_args(self, start=None):
+        """Call Facades function based on args..
+
+        start is a time.perf_counter() taken before importing this module,
+        the startup of a traced command is measured from it.
+        """
+        parsing = time.perf_counter()
         args = self._control(self._parser.parse_args())
+        # BOX_TRACE is a json trace path, or 1 for the summary
+        output = (args.trace or (args.profile and "-") or
+                  os.environ.get("BOX_TRACE"))
+        if not output:
+            self._run(args)
+            return
+
+        from tracing import TRACER
+
+        TRACER.enable()
+        start = start or parsing
+        TRACER.add_phase("startup", parsing - start)
+        TRACER.add_phase("parse arguments", time.perf_counter() - parsing)
+        try:
+            with TRACER.phase("command"):
+                self._run(args)
+        finally:
+            TRACER.emit(args.command, time.perf_counter() - start, output)
+
+    def _run(self, args):
+        """Run the command of parsed args."""
+        if args.command in ("sql", "find", "serve") and args.workers < 1:
+            exit("ERROR: workers must be positive.")
+        if args.command in SERVED_COMMANDS:
+            facade = self._served_facade()
         if args.command == "add":
-            self._facade.add_file(args.name, args.category,
-                                  args.description, args.tags)
+            attach = [os.path.abspath(p) for p in args.attach or []]
+            facade.add_file(args.name, args.category,
+                            args.description, args.tags, attach)
+        elif args.command == "import":
+            self._import(args)
         elif args.command == "rm":
-            self._facade.rm_file(args.file_id)
+            if self._is_batch(args):
+                self._batch(args)
+            else:
+                facade.rm_file(int(args.file_ids[0]))
         elif args.command == "mod":
             optional_args = [args.name, args.category,
-                             args.description, args.tags]
+                             args.description, args.tags,
+                             args.add_tags, args.rm_tags]
             if all(v is None for v in optional_args):
                 exit("ERROR: provide at least one argument to modify.")
+            elif self._is_batch(args):
+                self._batch(args)
             else:
-                self._facade.mod_file(args.file_id, args.name,
-                                      args.category, args.description,
-                                      args.tags)
+                file_id = int(args.file_ids[0])
+                if not facade.mod_file(file_id, args.name, args.category,
+                                       args.description, args.tags,
+                                       args.add_tags, args.rm_tags):
+                    exit("File with id {} doesn't exist.".format(file_id))
         elif args.command == "sql":
-            result = self._facade.execute(args.sql, args.select)
-            if result:
-                rst_json = json.loads(result)
-                print(format_dict_list(rst_json))
+            if (args.select and args.json and not args.columns and
+                    args.workers > 1):
+                # ranges are encoded to json in worker processes
+                print(self._facade.execute(args.sql, True, args.workers))
+            elif args.select:
+                rows = self._facade.execute_rows(args.sql, args.workers)
+                self._write_rows(rows, args, exit_if_empty=False)
+            else:
+                self._facade.execute(args.sql, args.select)
         elif args.command == "find":
-            result = self._facade.find_file(args.name, args.category,
-                                            args.description, args.tags)
+            if args.facets and (args.json or args.jsonl):
+                exit("ERROR: --facets only goes with tables, try box facets "
+                     "--json.")
+            if args.fuzzy and not args.name:
+                exit("ERROR: --fuzzy needs a name.")
+            cursor = None
+            if args.explain:
+                rows = facade.explain_find_file(
+                    args.name, args.category, args.description, args.tags,
+                    args.limit, args.tag_mode, args.content, args.fuzzy,
+                    args.order_by, args.after)
+            elif args.limit is not None:
+                rows, cursor = facade.find_page(
+                    args.name, args.category, args.description, args.tags,
+                    args.limit, args.tag_mode, args.workers, args.content,
+                    args.fuzzy, args.order_by, args.after)
+            else:
+                rows = facade.find_rows(
+                    args.name, args.category, args.description, args.tags,
+                    args.limit, args.tag_mode, args.workers, args.content,
+                    args.fuzzy, args.order_by, args.after)
+            self._write_rows(rows, args)
+            if cursor:
+                print("next page: --after " + cursor, file=sys.stderr)
+            if args.facets and not args.explain:
+                self._print_facets(facade.facets(
+                    args.name, args.category, args.description, args.tags,
+                    args.tag_mode, args.content))
+        elif args.command == "facets":
+            facets = facade.facets(args.name, args.category,
+                                   args.description, args.tags,
+                                   args.tag_mode, args.content, args.top)
             if args.json:
-                print(result)
+                import json
+
+                print(json.dumps(facets, indent=2))
             else:
-                rst_json = json.loads(result)
-                if rst_json:
-                    print(format_dict_list(rst_json))
-                else:
-                    exit("No results.")
+                self._print_facets(facets)
+        elif args.command == "stats":
+            for key, value in facade.stats().items():
+                print("{}: {}".format(key, value))
         elif args.command == "init":
             if self._facade.init():
                 print("Database created in: " + self._config.database_path)
             else:
                 exit("Database already exists in: " +
                      self._config.database_path)
+        elif args.command == "migrate":
+            start, end = self._facade.migrate(args.analyze)
+            if start == end:
+                print("Database is up to date, version {}.".format(end))
+            else:
+                print("Database migrated from version {} to {}.".format(
+                    start, end))
+        elif args.command == "cache":
+            if args.clear:
+                facade.clear_cache()
+            for key, value in facade.cache_stats().items():
+                print("{}: {}".format(key, value))
+        elif args.command == "serve":
+            from server import Server
+
+            try:
+                Server(args.socket, args.workers).serve_forever()
+            except KeyboardInterrupt:
+                pass
+        elif args.command == "bench":
+            self._bench(args)
+        elif args.command == "completion":
+            if args.refresh:
+                self._facade.refresh_vocabulary()
+            else:
+                import completion
+
+                script = (completion.zsh_script if args.shell == "zsh"
+                          else completion.bash_script)
+                print(script(self._parser), end="")
+        elif args.command == "dump":
+            self._dump(args)
+        elif args.command == "backup":
+            self._backup(args)
         elif args.command == "show":
-            result = self._facade.get_info(args.file_id)
-            rst_json = json.loads(result)
+            import json
+
+            from tracing import TRACER
+
+            result = facade.get_info(args.file_id)
+            with TRACER.phase("decode json"):
+                rst_json = json.loads(result)
             if rst_json:
+                attachments = rst_json.pop("attachments", None)
                 for key in rst_json:
                     print("{}: {}".format(key, rst_json[key]))
+                if attachments:
+                    print("attachments:")
+                    for attachment in attachments:
+                        print("    {name} ({mime}, {size} bytes) "
+                              "{hash}".format(**attachment))
             else:
                 exit("File with id {} doesn't exist.".format(args.file_id))
+        elif args.command == "open":
+            self._open(args)
+        elif args.command == "index":
+            self._index(args)
+        elif args.command == "gc":
+            count, size = self._facade.gc(args.dry_run, args.min_age)
+            print("{} {} documents, {} bytes.".format(
+                "Would remove" if args.dry_run else "Removed", count, size))
+
+    @staticmethod
+    def _bench(args):
+        """Run the benchmark and print its json report."""
+        import json
+
+        from bench import Benchmark, Corpus
+
+        if args.files < 1 or args.ops < 1 or args.scan_ops < 1:
+            exit("ERROR: files and ops must be positive.")
+        if min(args.workers) < 1:
+            exit("ERROR: workers must be positive.")
+        corpus = Corpus(args.files, args.categories, args.tags,
+                        args.tags_per_file, args.desc_words, args.seed)
+        benchmark = Benchmark(corpus, args.ops, workers=args.workers,
+                              scan_ops=args.scan_ops)
+        report = json.dumps(benchmark.run(), indent=2)
+        if args.output:
+            with open(args.output, "w") as output:
+                output.write(report + "\n")
+        else:
+            print(report)
+
+    def _dump(self, args):
+        """Stream the sql dump to stdout or a file, maybe compressed."""
+        import gzip
+        import io
+
+        compress = args.gzip or (args.output or "").endswith(".gz")
+        error_message = "ERROR: can't write the dump to {}: {}"
+        if args.output:
+            try:
+                target = open(args.output, "wb")
+            except OSError as error:
+                exit(error_message.format(args.output, error))
+        else:
+            target = sys.stdout.buffer
+        output = gzip.GzipFile(fileobj=target, mode="wb") if compress \
+            else target
+        stream = io.TextIOWrapper(output, encoding="utf-8")
+        try:
+            self._facade.write_dump(stream)
+            stream.flush()
+            # keep the binary output open, it's closed below
+            stream.detach()
+            if compress:
+                output.close()
+        except BrokenPipeError:
+            # stdout closed early, e.g. piped to head
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            exit(1)
+        except OSError as error:
+            exit(error_message.format(args.output or "stdout", error))
+        finally:
+            if args.output:
+                target.close()
+
+    def _index(self, args):
+        """Index the queued documents, or show the queue status."""
+        if args.status:
+            for key, value in self._facade.index_status().items():
+                print("{}: {}".format(key, value))
+            for name, error in self._facade.index_failures():
+                print("not indexed: {} ({})".format(name, error))
+            return
+        if args.workers is not None and args.workers < 1:
+            exit("ERROR: workers must be positive.")
+        start = time.perf_counter()
+        try:
+            counts = self._facade.index(args.workers, args.retry_failed)
+        except KeyboardInterrupt:
+            exit("Interrupted, the next run resumes the rest.")
+        print("Indexed {indexed} documents, {failed} failed, {skipped} "
+              "skipped in {seconds:.1f} s.".format(
+                  seconds=time.perf_counter() - start, **counts))
+
+    def _open(self, args):
+        """Open the documents of a file, or print their paths."""
+        import subprocess
+
+        paths = self._facade.attachment_paths(args.file_id, args.name,
+                                              links=not args.path)
+        if not paths:
+            exit("No documents attached to file {}{}.".format(
+                args.file_id, " called " + args.name if args.name else ""))
+        for name, path in paths:
+            if args.path:
+                print(path)
+                continue
+            if sys.platform.startswith("win"):
+                os.startfile(path)
+            else:
+                opener = "open" if sys.platform == "darwin" else "xdg-open"
+                try:
+                    subprocess.Popen([opener, path],
+                                     stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL)
+                except OSError as error:
+                    exit("ERROR: can't open {}: {}".format(name, error))
+
+    def _backup(self, args):
+        """Copy the database showing the progress on stderr."""
+        if args.pages < 1:
+            exit("ERROR: pages must be positive.")
+
+        def progress(remaining, total):
+            done = total - remaining
+            print("\rCopied {} of {} pages ({:.0f}%)".format(
+                done, total, 100.0 * done / total if total else 100),
+                end="", file=sys.stderr, flush=True)
+
+        quiet = args.quiet or not sys.stderr.isatty()
+        self._facade.backup(args.path, args.pages,
+                            None if quiet else progress)
+        if not quiet:
+            print(file=sys.stderr)
+        print("Database copied to: " + args.path)
+
+    @staticmethod
+    def _write_rows(rows, args, exit_if_empty=True):
+        """Stream rows to stdout in the format asked for."""
+        import shutil
+
+        from rows import Rows
+        from tracing import TRACER
+        from utilities import write_rows
+
+        if not isinstance(rows, Rows):
+            rows = Rows.from_dicts(rows)
+        first = rows.peek()
+        columns = args.columns if rows.columns else None
+        unknown = [c for c in columns or [] if c not in rows.columns]
+        if unknown:
+            exit("ERROR: unknown columns: " + ", ".join(unknown))
+
+        with TRACER.phase("output"):
+            try:
+                if args.jsonl:
+                    write_rows(rows, sys.stdout, "jsonl", columns)
+                elif args.json:
+                    write_rows(rows, sys.stdout, "json", columns)
+                else:
+                    if first is None:
+                        if exit_if_empty:
+                            exit("No results.")
+                        return
+                    max_width = None
+                    if sys.stdout.isatty():
+                        max_width = shutil.get_terminal_size().columns
+                    write_rows(rows, sys.stdout, "table", columns, max_width)
+                    print()
+                sys.stdout.flush()
+            except BrokenPipeError:
+                # stdout closed early, e.g. piped to head
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+                exit(1)
+
+    @staticmethod
+    def _print_facets(facets):
+        """Print the counts of every facet as a table."""
+        from rows import Rows
+        from utilities import write_rows
+
+        for facet, counts in facets.items():
+            write_rows(Rows((facet, "files"), counts), sys.stdout, "table")
+            print()
+
+    @staticmethod
+    def _is_batch(args):
+        """Return if rm or mod apply to more than a single file id."""
+        return (args.where or args.dry_run or len(args.file_ids) != 1 or
+                not args.file_ids[0].isdigit())
+
+    def _batch(self, args):
+        """Remove or modify every file matching filters and ids."""
+        from itertools import chain
+
+        if not args.where and not args.file_ids:
+            exit("ERROR: provide file ids or --where filters.")
+        where = self._parse_where(args.where or [])
+
+        ids = None
+        if args.file_ids:
+            from utilities import parse_ids
+
+            tokens = args.file_ids
+            if "-" in tokens:
+                tokens = [t for t in tokens if t != "-"]
+                stdin = (line.split() for line in sys.stdin)
+                tokens = chain(tokens, chain.from_iterable(stdin))
+            ids = parse_ids(tokens)
+
+        try:
+            if args.command == "rm":
+                count = self._facade.rm_files(where, ids, args.dry_run)
+                action = "removed"
+            else:
+                count = self._facade.mod_files(args.name, args.category,
+                                               args.description, args.tags,
+                                               where, ids, args.dry_run,
+                                               args.add_tags, args.rm_tags)
+                action = "modified"
+        except ValueError as error:
+            exit("ERROR: {}".format(error))
+
+        if args.dry_run:
+            print("{} files would be {}.".format(count, action))
+        else:
+            print("{} files {}.".format(count, action))
+
+    @staticmethod
+    def _parse_where(conditions):
+        """Return find filters from a list of field=value."""
+        where = {}
+        for condition in conditions:
+            field, sep, value = condition.partition("=")
+            if not sep or field not in WHERE_FIELDS:
+                exit("ERROR: invalid filter {}, use field=value with "
+                     "field one of {}.".format(condition,
+                                               ", ".join(WHERE_FIELDS)))
+            if not value.strip():
+                exit("ERROR: empty value in filter {}.".format(condition))
+            key = WHERE_FIELDS[field]
+            if key == "tags":
+                where.setdefault("tags", []).extend(value.split())
+            elif key == "tag_mode" and value not in ("any", "all", "regex"):
+                exit("ERROR: tag-mode must be any, all or regex.")
+            else:
+                where[key] = value
+        if list(where) == ["tag_mode"]:
+            exit("ERROR: tag-mode needs a tag filter.")
+        return where
+
+    def _import(self, args):
+        """Import files and report throughput."""
+        fmt = args.format
+        if not fmt:
+            fmt = "csv" if args.path.endswith(".csv") else "jsonl"
+        if args.batch_size < 1:
+            exit("ERROR: batch size must be positive.")
+
+        start = time.perf_counter()
+        try:
+            if args.path == "-":
+                count = self._facade.import_files(sys.stdin, fmt,
+                                                  args.batch_size)
+            else:
+                with open(args.path, newline="") as stream:
+                    count = self._facade.import_files(stream, fmt,
+                                                      args.batch_size)
+        except (ValueError, OSError) as error:
+            exit("ERROR: {}".format(error))
+        elapsed = time.perf_counter() - start
+
+        rate = count / elapsed if elapsed else 0
+        print("Imported {} files in {:.2f}s ({:.0f} rows/sec)".format(
+            count, elapsed, rate))
 
     def _control(self, args):
         """Parse lists to strings.
@@ -159,9 +899,11 @@ class CommandUI(object):
         Instead of:
         box add "long name" -c something -d "this is a description"
         """
-        if args.command in ["add", "mod", "find"]:
+        if args.command in ["add", "mod", "find", "facets"]:
             if args.name:
                 args.name = " ".join(args.name)
             if args.description:
                 args.description = " ".join(args.description)
+        if args.command in ["find", "facets"] and args.content:
+            args.content = " ".join(args.content)
         return args
@@ -0,0 +1,171 @@
+"""Shell completion scripts, generated from the argument parser.
+
+Commands, options and choices are written into the script. Categories
+and tags are read from the vocabulary files next to the database, so
+completing doesn't start python.
+"""
+
+# option values completed from the vocabulary
+VOCABULARY_DESTS = {"category": "categories", "tags": "tags",
+                    "add_tags": "tags", "rm_tags": "tags"}
+# option and positional values completed as paths
+PATH_DESTS = ("path", "output", "attach", "trace", "socket")
+
+BASH_SCRIPT = r"""# bash completion of box, generated by: box completion bash
+_box_vocabulary() {
+    # complete $cur with the names of the vocabulary file $1
+    local key value name quoted folder=
+    [[ -r ~/.boxrc ]] || return
+    while IFS='=' read -r key value; do
+        key=${key//[[:space:]]/}
+        if [[ $key == database_folder ]]; then
+            value=${value#"${value%%[![:space:]]*}"}
+            folder=${value%"${value##*[![:space:]]}"}
+            break
+        fi
+    done < ~/.boxrc
+    [[ -r ${folder%/}/vocabulary/$1 ]] || return
+    # awk filters long vocabularies faster than a loop, compgen -W would
+    # expand the names
+    while IFS= read -r name; do
+        printf -v quoted '%q' "$name"
+        COMPREPLY+=("$quoted")
+    done < <(BOX_PREFIX=$cur awk 'index($0, ENVIRON["BOX_PREFIX"]) == 1' \
+             "${folder%/}/vocabulary/$1")
+}
+
+_box_words() {
+    # set words to the options of command $1
+    case $1 in
+@OPTIONS@
+    esac
+}
+
+_box_value() {
+    # set kind and many for option $2 of command $1, fail if it has none
+    case "$1 $2" in
+@VALUES@
+        *) return 1 ;;
+    esac
+}
+
+_box() {
+    local cur=${COMP_WORDS[COMP_CWORD]} prev=${COMP_WORDS[COMP_CWORD-1]}
+    local command= option= words= kind= many= word i
+    COMPREPLY=()
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        word=${COMP_WORDS[i]}
+        if [[ -z $command ]]; then
+            case $word in
+@SKIP@
+                -*) ;;
+                *) command=$word ;;
+            esac
+        elif [[ $word == -* ]]; then
+            option=$word
+        fi
+    done
+
+    if [[ -z $command ]]; then
+        case $prev in
+@GLOBAL_VALUES@
+        esac
+        if [[ $cur == -* ]]; then
+            COMPREPLY=($(compgen -W '@GLOBAL_OPTIONS@' -- "$cur"))
+        else
+            COMPREPLY=($(compgen -W '@COMMANDS@' -- "$cur"))
+        fi
+        return
+    fi
+    if [[ $cur == -* ]]; then
+        _box_words "$command"
+        COMPREPLY=($(compgen -W "$words" -- "$cur"))
+        return
+    fi
+    if ! { [[ -n $option ]] && _box_value "$command" "$option" &&
+           [[ -n $many || $prev == "$option" ]]; }; then
+        # positional values
+        _box_value "$command" "" || return
+    fi
+    case $kind in
+        categories|tags) _box_vocabulary "$kind" ;;
+        path) COMPREPLY=($(compgen -f -- "$cur")) ;;
+        *) COMPREPLY=($(compgen -W "$kind" -- "$cur")) ;;
+    esac
+}
+
+complete -F _box box
+"""
+
+ZSH_SCRIPT = """# zsh completion of box, generated by: box completion zsh
+autoload -U +X bashcompinit && bashcompinit
+"""
+
+
+def _value_kind(action):
+    """Return how the values of an argument are completed, or None."""
+    if action.dest in VOCABULARY_DESTS and action.type in (None, str):
+        return VOCABULARY_DESTS[action.dest]
+    if action.choices:
+        return " ".join(str(choice) for choice in action.choices)
+    if action.dest in PATH_DESTS:
+        return "path"
+    return None
+
+
+def _commands(parser):
+    """Return the subcommand parsers of a parser by name."""
+    for action in parser._actions:
+        if action.choices and hasattr(action, "_name_parser_map"):
+            return action.choices
+    return {}
+
+
+def bash_script(parser):
+    """Return the bash completion script of a parser."""
+    commands = _commands(parser)
+    global_options = []
+    global_values = []
+    for action in parser._actions:
+        global_options.extend(action.option_strings)
+        if action.option_strings and action.nargs != 0:
+            global_values.extend(action.option_strings)
+
+    options = []
+    values = []
+    for name, subparser in commands.items():
+        words = [option for action in subparser._actions
+                 for option in action.option_strings]
+        options.append("        {}) words='{}' ;;".format(
+            name, " ".join(words)))
+        for action in subparser._actions:
+            kind = _value_kind(action)
+            if kind is None or action.nargs == 0:
+                continue
+            many = "1" if action.nargs in ("+", "*") else ""
+            patterns = action.option_strings or [""]
+            values.append("        {}) kind='{}' many={} ;;".format(
+                "|".join('"{} {}"'.format(name, option)
+                         for option in patterns), kind, many))
+
+    skip = complete_path = ""
+    if global_values:
+        skip = "                {}) ((i++)) ;;".format(
+            "|".join(global_values))
+        complete_path = ("            {}) COMPREPLY=($(compgen -f -- "
+                         "\"$cur\")); return ;;").format(
+                             "|".join(global_values))
+    script = BASH_SCRIPT
+    for name, value in (("OPTIONS", "\n".join(options)),
+                        ("VALUES", "\n".join(values)),
+                        ("SKIP", skip),
+                        ("GLOBAL_VALUES", complete_path),
+                        ("GLOBAL_OPTIONS", " ".join(global_options)),
+                        ("COMMANDS", " ".join(commands))):
+        script = script.replace("@{}@".format(name), value)
+    return script
+
+
+def zsh_script(parser):
+    """Return the zsh completion script, the bash one run by zsh."""
+    return ZSH_SCRIPT + bash_script(parser)
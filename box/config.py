@@ -2,6 +2,14 @@
 
 import configparser
 import os
+import re
+import threading
+
+from tracing import TRACER
+
+# sqlite pragmas that can be set in .boxrc
+PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size",
+           "temp_store")
 
 class Borg:
     """Borg singleton pattern."""
@@ -14,16 +22,37 @@ class Borg:
 
 
 class ConfigManager(Borg):
-    """Manages app configuration."""
+    """Manages app configuration.
+
+    The configuration file is read once per process.
+    """
+
+    _lock = threading.Lock()
 
     def __init__(self):
         """Constructor."""
         Borg.__init__(self)
-        self._parser = configparser.ConfigParser()
-        self._parser.read(os.path.join(os.path.expanduser("~"), ".boxrc"))
+        with self._lock:
+            if self.__dict__.get("_loaded"):
+                return
+            with TRACER.phase("config"):
+                self._load()
+
+    def _load(self):
+        """Read the configuration file."""
+        parser = configparser.ConfigParser()
+        parser.read(os.path.join(os.path.expanduser("~"), ".boxrc"))
+        self._parser = parser
         self.database_folder = self._load_db_folder()
         self.database_name = self._load_db_name()
         self.database_path = self.database_folder + self.database_name
+        self.socket_path = self._load_socket_path()
+        self.persistent_connection = self._load_persistent_connection()
+        self.pragmas = self._load_pragmas()
+        (self.query_cache, self.query_cache_entries,
+         self.query_cache_max_rows,
+         self.query_cache_persist) = self._load_query_cache()
+        self._loaded = True
 
     def _load_db_folder(self):
         """Load database path."""
@@ -32,3 +61,38 @@ class ConfigManager(Borg):
     def _load_db_name(self):
         """Load database path."""
         return self._parser["DEFAULT"]["database_name"]
+
+    def _load_socket_path(self):
+        """Load path of the daemon socket."""
+        return self._parser["DEFAULT"].get(
+            "socket_path", self.database_folder + "box.sock")
+
+    def _load_persistent_connection(self):
+        """Load if database connections are reused."""
+        return self._parser["DEFAULT"].getboolean("persistent_connection",
+                                                  fallback=False)
+
+    def _load_query_cache(self):
+        """Load if find and show results are cached, and the cache size.
+
+        Return enabled, max entries, max rows per entry and if the cache
+        is saved to disk.
+        """
+        section = self._parser["DEFAULT"]
+        return (section.getboolean("query_cache", fallback=True),
+                section.getint("query_cache_entries", fallback=256),
+                section.getint("query_cache_max_rows", fallback=1000),
+                section.getboolean("query_cache_persist", fallback=False))
+
+    def _load_pragmas(self):
+        """Load sqlite pragmas set on every connection."""
+        section = self._parser["DEFAULT"]
+        pragmas = {}
+        for pragma in PRAGMAS:
+            if pragma in section:
+                value = section[pragma]
+                if not re.match(r"^-?\w+$", value):
+                    raise ValueError("Invalid value for {}: {}".format(
+                        pragma, value))
+                pragmas[pragma] = value
+        return pragmas
@@ -1,15 +1,29 @@
 """Database manager."""
 
+import os
 import sqlite3
 import re
+import threading
+from functools import lru_cache
 
 from config import ConfigManager
+from migrations import MIGRATIONS
+from rows import Rows
+from tracing import TRACER
+
+# tables fts5 keeps the index of a virtual table in
+FTS_SHADOWS = ("config", "content", "data", "docsize", "idx")
+
+
+@lru_cache(maxsize=256)
+def compile_regexp(expr):
+    """Return a compiled pattern, cached by expression."""
+    return re.compile(expr)
 
 
 def regexp(expr, item):
     """For using REGEXP in sqlite."""
-    reg = re.compile(expr)
-    return reg.search(item) is not None
+    return compile_regexp(expr).search(item) is not None
 
 
 class Borg:
@@ -23,98 +37,238 @@ class Borg:
 
 
 class DatabaseManager(Borg):
-    """This class manages an Sqlite database."""
+    """This class manages an Sqlite database.
+
+    Every thread has its own connection. Nested with blocks share it and
+    it's closed when the outermost block exits, unless connections are
+    persistent or the thread called keep_open, then it's kept open for
+    the next block of that thread.
+    """
+
+    _lock = threading.Lock()
 
     def __init__(self):
         """Constructor."""
         Borg.__init__(self)
-        self._db = None
+        with self._lock:
+            if "_local" not in self.__dict__:
+                self._local = threading.local()
         self._config = ConfigManager()
         self._db_path = self._config.database_path
 
+    @property
+    def _db(self):
+        """Connection of the current thread."""
+        return getattr(self._local, "db", None)
+
     def __enter__(self):
         """Connect to database."""
-        self.connect(self._db_path)
+        if not self._db:
+            self.connect(self._db_path)
+        self._local.depth = getattr(self._local, "depth", 0) + 1
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         """Close connection to database."""
-        self.close()
+        self._local.depth -= 1
+        if exc_type:
+            self._db.rollback()
+        else:
+            self._db.commit()
+        if not self._local.depth and not self._persistent():
+            self.close()
+
+    def keep_open(self):
+        """Keep the connection of the current thread open between blocks."""
+        self._local.persistent = True
+
+    def _persistent(self):
+        """Return if the connection of the current thread is kept open."""
+        return (self._config.persistent_connection
+                or getattr(self._local, "persistent", False))
 
     def connect(self, path):
         """Connect to database."""
-        self._db = sqlite3.connect(path)
-        self._db.row_factory = sqlite3.Row
-        self._db.create_function("REGEXP", 2, regexp)
-        self._db.execute("PRAGMA foreign_keys = ON")
+        with TRACER.phase("connect"):
+            db = sqlite3.connect(path)
+            db.row_factory = sqlite3.Row
+            if TRACER.enabled:
+                db.create_function("REGEXP", 2,
+                                   TRACER.callback("REGEXP", regexp))
+                db.set_trace_callback(TRACER.statement_started)
+            else:
+                db.create_function("REGEXP", 2, regexp)
+            db.execute("PRAGMA foreign_keys = ON")
+            for pragma, value in self._config.pragmas.items():
+                db.execute("PRAGMA {} = {}".format(pragma, value))
+        self._local.db = db
 
     def close(self):
         """Commit and close connection."""
         if self._db:
             self._db.commit()
             self._db.close()
+            self._local.db = None
+
+    def commit(self):
+        """Commit current transaction."""
+        self._db.commit()
 
     def execute(self, sql, args=None):
         """Execute sql statement."""
+        if TRACER.enabled:
+            return TRACER.execute(self._db.execute, sql, args or ())
         if not args:
             return self._db.execute(sql)
         else:
             return self._db.execute(sql, args)
 
+    def select(self, sql, args=()):
+        """Execute a query, return its rows as tuples sharing a header."""
+        cursor = self._db.cursor()
+        cursor.row_factory = None
+        if TRACER.enabled:
+            cursor = TRACER.execute(cursor.execute, sql, args)
+        else:
+            cursor.execute(sql, args)
+        return Rows.from_cursor(cursor)
+
     def executemany(self, sql, args):
         """Execute multiple sql statements."""
-        self._db.executemany(sql, args)
+        if TRACER.enabled:
+            TRACER.execute(self._db.executemany, sql, args)
+        else:
+            self._db.executemany(sql, args)
+
+    def generation(self):
+        """Return the id of the database and its write generation."""
+        cursor = self._db.execute(
+            "SELECT value FROM box_meta "
+            "WHERE key IN ('database_id', 'generation') ORDER BY key")
+        return [row[0] for row in cursor]
+
+    def bump_generation(self):
+        """Mark the database as changed, in the current transaction."""
+        self._db.execute(
+            "UPDATE box_meta SET value = value + 1 WHERE key='generation'")
 
     def setup(self):
         """Create tables."""
-        self._db.execute("""
-            CREATE TABLE if not exists categories (
-                name TEXT PRIMARY KEY NOT NULL
-            );
-        """)
-        self._db.execute("""
-            CREATE TABLE if not exists tags (
-                name TEXT PRIMARY KEY NOT NULL
-            );
-        """)
-        self._db.execute("""
-            CREATE TABLE if not exists files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-                name TEXT NOT NULL,
-                desc TEXT,
-                category_name TEXT NOT NULL,
-
-                FOREIGN KEY(category_name)
-                    REFERENCES categories(name)
-            );
-        """)
-        self._db.execute("""
-            CREATE TABLE if not exists file_tags (
-                file_id INTEGER NOT NULL,
-                tag_name TEXT NOT NULL,
-
-                PRIMARY KEY(file_id, tag_name),
-
-                FOREIGN KEY(file_id)
-                    REFERENCES files(id)
-                    ON DELETE CASCADE,
-                FOREIGN KEY(tag_name)
-                    REFERENCES tags(name)
-                    ON UPDATE CASCADE
-                    ON DELETE CASCADE
-            );
-        """)
+        self.migrate()
+
+    def schema_version(self):
+        """Return the schema version of the database."""
+        return self._db.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self, analyze=False):
+        """Apply pending migrations, each one in its own transaction.
+
+        Return the versions before and after migrating. Planner statistics
+        are refreshed when something changed or analyze is True. The write
+        lock is only taken while migrations are pending, so reads don't
+        wait for writers.
+        """
+        self._db.commit()
+        start = self.schema_version()
+        while self.schema_version() < len(MIGRATIONS):
+            self._db.execute("BEGIN IMMEDIATE")
+            # read again under the write lock, other process may migrate
+            version = self.schema_version()
+            if version >= len(MIGRATIONS):
+                self._db.rollback()
+                break
+            for sql in MIGRATIONS[version]:
+                if callable(sql):
+                    sql(self._db)
+                else:
+                    self._db.execute(sql)
+            self._db.execute("PRAGMA user_version = {}".format(version + 1))
+            self._db.commit()
+
+        version = self.schema_version()
+        if analyze or version != start:
+            self._db.execute("ANALYZE")
+            self._db.commit()
+        return start, version
 
     def _reset_db(self):
+        self._db.execute("DROP TABLE if exists files_fts")
         self._db.execute("DROP TABLE if exists file_tags")
         self._db.execute("DROP TABLE if exists files")
         self._db.execute("DROP TABLE if exists categories")
         self._db.execute("DROP TABLE if exists tags")
+        self._db.execute("DROP TABLE if exists box_meta")
+        self._db.execute("DROP TABLE if exists attachments")
+        self._db.execute("DROP TABLE if exists documents_fts")
+        self._db.execute("DROP TABLE if exists document_text")
+        self._db.execute("DROP TABLE if exists extract_queue")
+        self._db.execute("DROP TABLE if exists category_counts")
+        self._db.execute("DROP TABLE if exists tag_counts")
+        self._db.execute("DROP TABLE if exists file_trigrams")
+        self._db.execute("PRAGMA user_version = 0")
         self.setup()
 
     def dump(self):
         """Return a string with database contents."""
-        result = ""
-        for line in self._db.iterdump():
-            result += line + "\n"
-        return result
+        return "".join(line + "\n" for line in self.iter_dump())
+
+    def iter_dump(self):
+        """Yield the sql statements of the database contents.
+
+        They're read in one transaction, so they're consistent even if
+        other connections write meanwhile. Full text indexes are created
+        empty and rebuilt from their content tables at the end, instead of
+        dumping their shadow tables, and the schema version is kept, so
+        the dump restores into a new database.
+        """
+        self._db.commit()
+        self._db.execute("BEGIN")
+        try:
+            virtual = dict(self._db.execute(
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE sql LIKE 'CREATE VIRTUAL TABLE%'"))
+            names = "|".join(re.escape(name) for name in virtual)
+            skipped = re.compile(
+                r"""(CREATE TABLE|INSERT INTO) ['"]({0})(_({1}))?['"]"""
+                r"|PRAGMA writable_schema".format(
+                    names, "|".join(FTS_SHADOWS)))
+            for statement in self._db.iterdump():
+                if statement.startswith("INSERT INTO sqlite_master"):
+                    name = re.search(r"VALUES\('table','([^']*)'",
+                                     statement).group(1)
+                    yield virtual[name] + ";"
+                elif virtual and skipped.match(statement):
+                    continue
+                elif statement == "COMMIT;":
+                    for name in virtual:
+                        yield "INSERT INTO {0}({0}) VALUES('rebuild');".format(
+                            name)
+                    yield "PRAGMA user_version = {};".format(
+                        self.schema_version())
+                    yield statement
+                else:
+                    yield statement
+        finally:
+            self._db.rollback()
+
+    def backup(self, path, pages=256, progress=None):
+        """Copy the database to path, pages at a time.
+
+        Other connections can write between steps, the copy starts again
+        if they do. progress(remaining, total) is called after every step.
+        The copy is written next to path and renamed when complete.
+        """
+        tmp_path = path + ".tmp"
+        target = sqlite3.connect(tmp_path)
+        try:
+            self._db.commit()
+            self._db.backup(
+                target, pages=pages,
+                progress=progress and (lambda status, remaining, total:
+                                       progress(remaining, total)))
+        except BaseException:
+            target.close()
+            os.unlink(tmp_path)
+            raise
+        target.close()
+        os.replace(tmp_path, path)
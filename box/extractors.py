@@ -0,0 +1,81 @@
+"""Text extractors of attached documents, chosen by mime type.
+
+Other extractors can be plugged in with the extractor decorator, they
+take the path of a document and return its text.
+"""
+
+import shutil
+import subprocess
+import time
+
+# text kept per document, the rest isn't indexed
+MAX_TEXT_CHARS = 10 * 1024 * 1024
+
+EXTRACTORS = {}
+
+
+class ExtractionError(Exception):
+    """A document couldn't be read."""
+
+
+def extractor(*mimes):
+    """Register a function as the extractor of some mime types.
+
+    A type like "text/*" matches every type without its own extractor.
+    """
+    def register(function):
+        for mime in mimes:
+            EXTRACTORS[mime] = function
+        return function
+    return register
+
+
+def find_extractor(mime):
+    """Return the extractor of a mime type, None if there is none."""
+    if not mime:
+        return None
+    return EXTRACTORS.get(mime) or EXTRACTORS.get(
+        mime.split("/")[0] + "/*")
+
+
+@extractor("text/*")
+def plain_text(path):
+    """Return the text of a text file, undecodable bytes replaced."""
+    with open(path, encoding="utf-8", errors="replace") as document:
+        return document.read(MAX_TEXT_CHARS)
+
+
+@extractor("application/pdf")
+def pdf_text(path):
+    """Return the text layer of a pdf.
+
+    Uses the pypdf package if it's installed, the pdftotext command of
+    poppler otherwise. Scanned pages without a text layer give no text.
+    """
+    try:
+        import pypdf
+    except ImportError:
+        pypdf = None
+    if pypdf:
+        reader = pypdf.PdfReader(path)
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+        return text[:MAX_TEXT_CHARS]
+
+    if not shutil.which("pdftotext"):
+        raise ExtractionError("install pypdf or pdftotext to read pdfs")
+    result = subprocess.run(["pdftotext", "-q", path, "-"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode:
+        raise ExtractionError("pdftotext failed with code {}".format(
+            result.returncode))
+    return result.stdout.decode("utf-8", "replace")[:MAX_TEXT_CHARS]
+
+
+def extract(path, mime):
+    """Return the text of a document and the seconds it took.
+
+    Run in the worker processes of the indexer.
+    """
+    start = time.perf_counter()
+    text = find_extractor(mime)(path)
+    return text, time.perf_counter() - start
@@ -1,13 +1,20 @@
 """Facade design pattern."""
 
-import json
+import os
+import sqlite3
 
 from os.path import isfile
 
+from blob_store import BlobStore, GC_GRACE_SECONDS
 from db_manager import DatabaseManager
 from file_manager import FileManager
+from indexer import Indexer
 from config import ConfigManager
-from utilities import mkdir_if_not_exists
+import parallel
+from rows import Rows
+from tracing import TRACER
+from utilities import dumps_rows, mkdir_if_not_exists, read_records
+from vocabulary import Vocabulary
 
 
 class Borg:
@@ -29,38 +36,213 @@ class Facade(Borg):
         self.file_manager = FileManager()
         self._config = ConfigManager()
 
-    def add_file(self, name, category_name, desc=None, tags=None):
-        """Add a new file."""
+    def add_file(self, name, category_name, desc=None, tags=None,
+                 attach=None):
+        """Add a new file, storing the documents of attach, return its id."""
         self._exit_if_not_db()
-        self.file_manager.add_file(name, category_name, desc, tags)
+        attachments = []
+        for path in attach or []:
+            try:
+                digest, size, mime = self.blob_store.put(path)
+            except OSError as error:
+                exit("ERROR: can't attach {}: {}".format(path, error))
+            attachments.append((digest, os.path.basename(path), size, mime))
+        return self.file_manager.add_file(name, category_name, desc, tags,
+                                          attachments)
+
+    @property
+    def blob_store(self):
+        """Store of the attached documents, next to the database."""
+        return BlobStore(os.path.join(self._config.database_folder,
+                                      "blobs"))
+
+    def attachment_paths(self, file_id, name=None, links=False):
+        """Return the names and stored paths of the documents of a file.
+
+        Only the ones called name if it's given. With links the paths
+        are links named like the documents, see BlobStore.link.
+        """
+        info = self.info(file_id)
+        if not info:
+            exit("File with id {} doesn't exist.".format(file_id))
+        store = self.blob_store
+        return [(a["name"], store.link(a["hash"], a["name"]) if links
+                 else store.path(a["hash"]))
+                for a in info["attachments"]
+                if name is None or a["name"] == name]
+
+    def gc(self, dry_run=False, min_age=GC_GRACE_SECONDS):
+        """Remove stored documents no file refers to.
+
+        Return how many are, or with dry_run would be, removed and their
+        size.
+        """
+        self._exit_if_not_db()
+        if not dry_run:
+            Indexer.prune()
+        referenced = self.file_manager.attached_hashes()
+        return self.blob_store.gc(referenced, dry_run, min_age)
+
+    def import_files(self, stream, fmt, batch_size=1000):
+        """Import files from a csv or json lines stream."""
+        self._exit_if_not_db()
+        records = read_records(stream, fmt)
+        return self.file_manager.import_files(records, batch_size)
 
     def rm_file(self, file_id):
         """Remove a file."""
         self._exit_if_not_db()
         self.file_manager.rm_file(file_id)
 
-    def mod_file(self, file_id, name, category, description, tags):
-        """Modify file."""
+    def rm_files(self, where=None, ids=None, dry_run=False):
+        """Remove the files matching filters and ids."""
+        self._exit_if_not_db()
+        return self.file_manager.rm_files(where, ids, dry_run)
+
+    def mod_files(self, name, category, description, tags, where=None,
+                  ids=None, dry_run=False, add_tags=None, rm_tags=None):
+        """Modify the files matching filters and ids."""
         self._exit_if_not_db()
-        self.file_manager.mod_file(file_id, name, category, description, tags)
+        return self.file_manager.mod_files(name, category, description, tags,
+                                           where, ids, dry_run, add_tags,
+                                           rm_tags)
+
+    def mod_file(self, file_id, name, category, description, tags,
+                 add_tags=None, rm_tags=None):
+        """Modify file, return False if it doesn't exist."""
+        self._exit_if_not_db()
+        return self.file_manager.mod_file(file_id, name, category,
+                                          description, tags, add_tags,
+                                          rm_tags)
+
+    def execute(self, sql, select, workers=1):
+        """Execute query.
 
-    def execute(self, sql, select):
-        """Execute query."""
+        With several workers a select over files is run once per range of
+        file ids, in parallel processes, and the results concatenated,
+        unless parallel.splittable says it must run whole.
+        """
+        if select and workers > 1:
+            self._exit_if_not_db()
+            return parallel.select_json(sql, workers)
+        if select:
+            return dumps_rows(self.execute_rows(sql))
         self._exit_if_not_db()
         with DatabaseManager() as db:
-            cursor = db.execute(sql)
-            if select:
-                dict_list = []
-                for row in cursor.fetchall():
-                    dict_list.append(dict(row))
+            db.execute(sql)
+            db.bump_generation()
+            Vocabulary().rebuild(db)
+        return None
 
-                return json.dumps(dict_list, indent=2)
-            return None
+    def iter_execute(self, sql, workers=1):
+        """Execute a select query yielding rows one by one as dicts."""
+        return self.execute_rows(sql, workers).dicts()
 
-    def find_file(self, name, category, description, tags):
+    def execute_rows(self, sql, workers=1):
+        """Execute a select query, return its Rows.
+
+        With several workers a select over files is run once per range of
+        file ids, in parallel threads, and the results concatenated,
+        unless parallel.splittable says it must run whole.
+        """
+        self._exit_if_not_db()
+        if workers > 1:
+            return parallel.select_rows(sql, workers)
+        return Rows.headed(self._select(sql))
+
+    @staticmethod
+    def _select(sql):
+        """Yield the columns of a select, then its rows."""
+        with DatabaseManager() as db:
+            rows = db.select(sql)
+            yield rows.columns
+            yield from rows
+
+    def find_file(self, name, category, description, tags, limit=None,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
         """Find files."""
+        return self._find("find_file", name, category, description, tags,
+                          limit, tag_mode, workers, content, fuzzy, order_by,
+                          after)
+
+    def iter_find_file(self, name, category, description, tags, limit=None,
+                       tag_mode="any", workers=1, content=None, fuzzy=False,
+                       order_by=None, after=None):
+        """Find files yielding them one by one."""
+        return self._find("iter_find", name, category, description, tags,
+                          limit, tag_mode, workers, content, fuzzy, order_by,
+                          after)
+
+    def find_rows(self, name, category, description, tags, limit=None,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
+        """Find files, return their Rows."""
+        return self._find("find_rows", name, category, description, tags,
+                          limit, tag_mode, workers, content, fuzzy, order_by,
+                          after)
+
+    def find_page(self, name, category, description, tags, limit,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
+        """Return up to limit found files as dicts, and the next cursor.
+
+        Pass the cursor as after to get the next page, it's None on the
+        last one.
+        """
+        return self._find("find_page", name, category, description, tags,
+                          limit, tag_mode, workers, content, fuzzy, order_by,
+                          after)
+
+    def explain_find_file(self, name, category, description, tags,
+                          limit=None, tag_mode="any", content=None,
+                          fuzzy=False, order_by=None, after=None):
+        """Return the query plan of a find."""
+        return self._find("explain_find", name, category, description, tags,
+                          limit, tag_mode, content, fuzzy, order_by, after)
+
+    def _find(self, method, *args):
+        """Call a find of the file manager, exit on bad filters or order."""
         self._exit_if_not_db()
-        return self.file_manager.find_file(name, category, description, tags)
+        try:
+            return getattr(self.file_manager, method)(*args)
+        except ValueError as error:
+            exit("ERROR: {}.".format(error))
+
+    def refresh_vocabulary(self):
+        """Write the categories and tags read by shell completion."""
+        self._exit_if_not_db()
+        with DatabaseManager() as db:
+            Vocabulary().rebuild(db)
+
+    def stats(self):
+        """Return how many files, categories and tags there are."""
+        self._exit_if_not_db()
+        return self.file_manager.stats()
+
+    def facets(self, name=None, category=None, description=None, tags=None,
+               tag_mode="any", content=None, top=None):
+        """Return the files per category and per tag of the found files."""
+        return self._find("facets", name, category, description, tags,
+                          tag_mode, content, top)
+
+    def index(self, workers=None, retry_failed=False):
+        """Extract and index the text of the queued documents.
+
+        Return how many documents were indexed, failed and skipped.
+        """
+        self._exit_if_not_db()
+        return Indexer(self.blob_store, workers).run(retry_failed)
+
+    def index_status(self):
+        """Return the backlog and throughput of document extraction."""
+        self._exit_if_not_db()
+        return Indexer.status()
+
+    def index_failures(self):
+        """Return the names and errors of the documents not indexed."""
+        self._exit_if_not_db()
+        return Indexer.failures()
 
     def init(self):
         """Initialize database."""
@@ -68,6 +250,8 @@ class Facade(Borg):
             mkdir_if_not_exists(self._config.database_folder)
             with DatabaseManager() as db:
                 db.setup()
+                Vocabulary().rebuild(db)
+            self._checked_path = self._config.database_path
             return True
         return False
 
@@ -76,11 +260,59 @@ class Facade(Borg):
         with DatabaseManager() as db:
             return db.dump()
 
-    def _exit_if_not_db(self):
-        """Exit if not DB."""
+    def write_dump(self, stream):
+        """Write the database contents as sql to a text stream."""
+        self._exit_if_not_db()
+        with DatabaseManager() as db:
+            for line in db.iter_dump():
+                stream.write(line + "\n")
+
+    def backup(self, path, pages=256, progress=None):
+        """Copy the database to path while it's in use."""
+        self._exit_if_not_db()
+        try:
+            with DatabaseManager() as db:
+                db.backup(path, pages, progress)
+        except (OSError, sqlite3.Error) as error:
+            exit("ERROR: can't copy the database to {}: {}".format(path,
+                                                                  error))
+
+    def migrate(self, analyze=False):
+        """Apply pending schema migrations.
+
+        Return the schema versions before and after migrating.
+        """
+        self._exit_if_not_db(migrate=False)
+        with DatabaseManager() as db:
+            versions = db.migrate(analyze)
+            if versions[0] != versions[1]:
+                Vocabulary().rebuild(db)
+        self._checked_path = self._config.database_path
+        return versions
+
+    def _exit_if_not_db(self, migrate=True):
+        """Exit if not DB, migrate its schema the first time."""
         if not isfile(self._config.database_path):
             exit("Database not found, try to use the command: \n$ box init")
+        checked_path = self.__dict__.get("_checked_path")
+        if migrate and checked_path != self._config.database_path:
+            with TRACER.phase("migrate"):
+                self.migrate()
+
+    def cache_stats(self):
+        """Return the query cache counters."""
+        return self.file_manager.cache_stats()
+
+    def clear_cache(self):
+        """Drop cached query results."""
+        self.file_manager.clear_cache()
 
     def get_info(self, file_id):
         """Find files."""
+        self._exit_if_not_db()
         return self.file_manager.get_info(file_id)
+
+    def info(self, file_id):
+        """Return all info about a file as a dict, empty if it's missing."""
+        self._exit_if_not_db()
+        return self.file_manager.info(file_id)
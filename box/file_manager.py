@@ -1,7 +1,121 @@
 """Manages Files."""
 
-from db_manager import DatabaseManager
+from cache import QueryCache, cache_key
+from db_manager import DatabaseManager, compile_regexp
+from fuzzy import MIN_SIMILARITY, trigrams
+from rows import Rows
+from utilities import chunks, dumps_rows, split_tags
+from vocabulary import Vocabulary
+from itertools import islice
+import base64
+import copy
 import json
+import math
+import parallel
+import re
+
+
+FILE_COLUMNS = """
+    files.id, files.name, files.desc, files.category_name,
+    (SELECT group_concat(tag_name, char(31)) FROM file_tags
+     WHERE file_tags.file_id=files.id) AS tags
+"""
+
+# semi join on file_tags, driven by the tag_name index
+TAGGED = "files.id IN (SELECT file_id FROM file_tags WHERE {})"
+
+# files having enough of the trigrams searched, scored by that share
+# plus the jaccard similarity of both sets so closer names come first
+FUZZY = """
+    JOIN (SELECT file_id, count(*) * 1.0 / ? + count(*) * 1.0 / (
+              ? - count(*) + (SELECT count(*) FROM file_trigrams AS own
+                              WHERE own.file_id=file_trigrams.file_id))
+              AS score
+          FROM file_trigrams WHERE trigram IN ({})
+          GROUP BY file_id HAVING count(*) >= ?) AS fuzzy
+        ON files.id=fuzzy.file_id
+"""
+
+# sort keys of found files besides their id, which breaks ties; ranked
+# searches can also be sorted by rank
+ORDERS = {
+    "id": [],
+    "name": ["files.name"],
+    "category": ["files.category_name"],
+}
+
+# facets of the files, with the table counting them and its columns
+FACETS = {
+    "category": ("category_counts", "files", "category_name", "id"),
+    "tag": ("tag_counts", "file_tags", "tag_name", "file_id"),
+}
+
+# files with an attached document whose text matches
+DOCUMENTED = """
+    files.id IN (SELECT file_id FROM attachments WHERE hash IN (
+        SELECT hash FROM document_text WHERE id IN (
+            SELECT rowid FROM documents_fts WHERE documents_fts MATCH ?)))
+"""
+
+
+class QueryBuilder(object):
+    """Build a select from its clauses, keeping arguments in order.
+
+    Only the joins and conditions added are part of the query.
+    """
+
+    def __init__(self, columns, table):
+        """Constructor."""
+        self._columns = columns
+        self._table = table
+        self._joins = []
+        self._join_args = []
+        self._where = []
+        self._where_args = []
+        self._order_by = []
+        self._limit = None
+
+    def join(self, clause, *args):
+        """Add a join clause."""
+        self._joins.append(clause)
+        self._join_args.extend(args)
+        return self
+
+    def where(self, condition, *args):
+        """Add a condition, all of them must be true."""
+        self._where.append(condition)
+        self._where_args.extend(args)
+        return self
+
+    def filtered(self):
+        """Return if a join or condition narrows the rows."""
+        return bool(self._joins or self._where)
+
+    def order_by(self, clause):
+        """Add an ordering term."""
+        self._order_by.append(clause)
+        return self
+
+    def limit(self, limit):
+        """Limit the number of rows."""
+        self._limit = limit
+        return self
+
+    def build(self):
+        """Return the sql and its arguments."""
+        sql = "SELECT {} FROM {}".format(self._columns, self._table)
+        args = list(self._join_args)
+        for clause in self._joins:
+            sql += " " + clause
+        if self._where:
+            sql += " WHERE " + " AND ".join(self._where)
+            args.extend(self._where_args)
+        if self._order_by:
+            sql += " ORDER BY " + ", ".join(self._order_by)
+        if self._limit is not None:
+            sql += " LIMIT ?"
+            args.append(self._limit)
+        return sql, tuple(args)
 
 
 class Borg:
@@ -20,11 +134,16 @@ class FileManager(Borg):
     def __init__(self):
         """Constructor."""
         Borg.__init__(self)
+        self._cache = QueryCache()
+        self._vocabulary = Vocabulary()
 
-    def add_file(self, name, category_name, desc="", tags=None):
-        """Add new file."""
+    def add_file(self, name, category_name, desc="", tags=None,
+                 attachments=None):
+        """Add new file, return its id.
+
+        attachments are (hash, name, size, mime) of blobs already stored.
+        """
         with DatabaseManager() as db:
-            db.setup()
             # insert or ignore if exists
             db.execute("INSERT OR IGNORE INTO categories(name) values(?)",
                        (category_name,))
@@ -32,114 +151,703 @@ class FileManager(Borg):
             cursor = db.execute(
                 "INSERT INTO files(name, category_name, desc) values(?, ?, ?)",
                 (name, category_name, desc))
+            db.bump_generation()
             letter_tag = category_name[0].lower()
             if tags:
                 tags.append(letter_tag)
             else:
                 tags = [letter_tag]
             self.insert_tags(db, tags, cursor.lastrowid)
+            self.index_name(db, cursor.lastrowid, name)
+            self._vocabulary.add(db, [category_name],
+                                 [tag.lower() for tag in tags])
+            if attachments:
+                db.executemany(
+                    "INSERT OR IGNORE INTO attachments"
+                    "(file_id, hash, name, size, mime) values(?, ?, ?, ?, ?)",
+                    [(cursor.lastrowid,) + tuple(a) for a in attachments])
+        return cursor.lastrowid
+
+    @staticmethod
+    def attachments(db, file_id):
+        """Return the attachments of a file as dicts."""
+        rows = db.select("SELECT hash, name, size, mime FROM attachments "
+                         "WHERE file_id=? ORDER BY name", (file_id,))
+        return list(rows.dicts())
+
+    @staticmethod
+    def attached_hashes():
+        """Return the hashes of every attached blob."""
+        with DatabaseManager() as db:
+            return set(row[0] for row in db.select(
+                "SELECT DISTINCT hash FROM attachments"))
 
     def rm_file(self, file_id):
         """Remove file."""
         with DatabaseManager() as db:
             db.execute("DELETE FROM files where id=?", (file_id,))
+            db.bump_generation()
+            self._vocabulary.rebuild(db)
 
-    def mod_file(self, file_id, name, category, description, tags):
-        """Modify file."""
+    def rm_files(self, where=None, ids=None, dry_run=False):
+        """Remove the files matching the filters of where and in ids.
+
+        Return how many files are, or with dry_run would be, removed.
+        """
         with DatabaseManager() as db:
-            cursor = db.execute("SELECT * FROM files where id=?", (file_id,))
-            result = cursor.fetchone()
+            db.execute("BEGIN IMMEDIATE")
+            count = self._select_batch(db, where, ids)
+            if count and not dry_run:
+                db.execute(
+                    "DELETE FROM files WHERE id IN (SELECT id FROM batch_ids)")
+                db.bump_generation()
+                self._vocabulary.rebuild(db)
+            db.execute("DROP TABLE temp.batch_ids")
+        return count
+
+    def mod_files(self, name, category, description, tags, where=None,
+                  ids=None, dry_run=False, add_tags=None, rm_tags=None):
+        """Modify the files matching the filters of where and in ids.
+
+        Every change is a single statement over the whole set, tags are
+        handled like mod_file does. Return how many files are, or with
+        dry_run would be, matched.
+        """
+        with DatabaseManager() as db:
+            db.execute("BEGIN IMMEDIATE")
+            count = self._select_batch(db, where, ids)
+            if count and not dry_run:
+                self._mod_batch(db, name, category, description, tags,
+                                add_tags, rm_tags)
+                db.bump_generation()
+                self._vocabulary.rebuild(db)
+            db.execute("DROP TABLE temp.batch_ids")
+        return count
+
+    def _select_batch(self, db, where, ids):
+        """Fill temp.batch_ids with the files to change, return how many."""
+        query = self.filter_query("files.id", **(where or {}))
+        if ids is None and not query.filtered():
+            raise ValueError("the filters match every file")
+        db.execute("CREATE TEMP TABLE batch_ids (id INTEGER PRIMARY KEY)")
+        if ids is not None:
+            db.execute(
+                "CREATE TEMP TABLE batch_input (id INTEGER PRIMARY KEY)")
+            db.executemany("INSERT OR IGNORE INTO batch_input VALUES (?)",
+                           ((file_id,) for file_id in ids))
+            query.where("files.id IN (SELECT id FROM batch_input)")
+
+        sql, args = query.build()
+        db.execute("INSERT INTO batch_ids " + sql, args)
+        if ids is not None:
+            db.execute("DROP TABLE temp.batch_input")
+        return db.execute("SELECT count(*) FROM batch_ids").fetchone()[0]
 
-            if not name:
-                name = result["name"]
-            if not category:
-                category = result["category_name"]
-            if not description:
-                description = result["desc"]
-            if not tags:
-                cur = db.execute(
-                    "SELECT tag_name FROM file_tags WHERE file_id=?",
-                    (file_id,))
-                tags = [t["tag_name"] for t in cur.fetchall()]
-            letter_tag = category[0].lower()
-            tags.append(letter_tag)
-
-            sql_args = (name, category, description, file_id)
-
-            db.execute("")
+    @staticmethod
+    def _mod_batch(db, name, category, description, tags, add_tags,
+                   rm_tags):
+        """Apply changes to the files in temp.batch_ids."""
+        in_batch = "IN (SELECT id FROM batch_ids)"
+        letter = "lower(substr(category_name, 1, 1))"
+
+        if category:
             # insert or ignore if exists
             db.execute("INSERT OR IGNORE INTO categories(name) values(?)",
                        (category,))
+            # the old category letter tag goes away with the category
+            db.execute("""
+                DELETE FROM file_tags WHERE file_id {} AND tag_name=(
+                    SELECT {} FROM files WHERE files.id=file_tags.file_id)
+            """.format(in_batch, letter))
 
-            db.execute("UPDATE files SET name = ?, " +
-                       "category_name = ?, desc = ? WHERE id = ?", sql_args)
+        columns = []
+        args = []
+        for column, value in (("name", name), ("category_name", category),
+                              ("desc", description)):
+            if value:
+                columns.append(column)
+                args.append(value)
+        if columns:
+            # skip the rows that already have those values
+            db.execute("UPDATE files SET {} WHERE id {} AND ({})".format(
+                ", ".join(c + " = ?" for c in columns), in_batch,
+                " OR ".join(c + " IS NOT ?" for c in columns)), args + args)
 
-            db.execute("DELETE FROM file_tags WHERE file_id = ?", (file_id,))
+        if name:
+            db.execute("DELETE FROM file_trigrams WHERE file_id " + in_batch)
+            db.executemany("INSERT INTO file_trigrams(trigram, file_id) "
+                           "SELECT ?, id FROM batch_ids",
+                           [(gram,) for gram in sorted(trigrams(name))])
 
-            if tags:
-                self.insert_tags(db, tags, file_id)
+        if tags:
+            tags = [(tag,) for tag in sorted(set(t.lower() for t in tags))]
+            db.execute("DELETE FROM file_tags WHERE file_id " + in_batch)
+            db.executemany("INSERT OR IGNORE INTO tags values(?)", tags)
+            db.executemany("INSERT INTO file_tags(file_id, tag_name) "
+                           "SELECT id, ? FROM batch_ids", tags)
+
+        if tags or category:
+            # category letter tag
+            db.execute("INSERT OR IGNORE INTO tags(name) "
+                       "SELECT DISTINCT {} FROM files WHERE id {}".format(
+                           letter, in_batch))
+            db.execute("INSERT OR IGNORE INTO file_tags(file_id, tag_name) "
+                       "SELECT id, {} FROM files WHERE id {}".format(
+                           letter, in_batch))
+
+        if add_tags:
+            add_tags = [(tag,) for tag in set(t.lower() for t in add_tags)]
+            db.executemany("INSERT OR IGNORE INTO tags values(?)", add_tags)
+            db.executemany("INSERT OR IGNORE INTO "
+                           "file_tags(file_id, tag_name) "
+                           "SELECT id, ? FROM batch_ids", add_tags)
+
+        if rm_tags:
+            rm_tags = sorted(set(t.lower() for t in rm_tags))
+            db.execute("DELETE FROM file_tags WHERE file_id {} AND "
+                       "tag_name IN ({})".format(
+                           in_batch, ", ".join("?" * len(rm_tags))), rm_tags)
+
+    def mod_file(self, file_id, name, category, description, tags,
+                 add_tags=None, rm_tags=None):
+        """Modify file.
+
+        Only the columns and tags that change are written. Tags replace
+        the tags of the file, add_tags and rm_tags are applied after. The
+        category letter tag follows the category.
+
+        Return False if the file doesn't exist.
+        """
+        with DatabaseManager() as db:
+            cursor = db.execute("SELECT * FROM files where id=?", (file_id,))
+            result = cursor.fetchone()
+            if not result:
+                return False
+
+            changes = {}
+            for column, value in (("name", name), ("category_name", category),
+                                  ("desc", description)):
+                if value and value != result[column]:
+                    changes[column] = value
+
+            cursor = db.execute(
+                "SELECT tag_name FROM file_tags WHERE file_id=?", (file_id,))
+            current = set(row["tag_name"] for row in cursor)
+            new_tags = self.tag_diff(current, result["category_name"],
+                                     category or result["category_name"],
+                                     tags, add_tags, rm_tags)
+            removed = current - new_tags
+            added = new_tags - current
+
+            if not changes and not removed and not added:
+                return True
+
+            if "category_name" in changes:
+                # insert or ignore if exists
+                db.execute("INSERT OR IGNORE INTO categories(name) values(?)",
+                           (category,))
+            if changes:
+                db.execute("UPDATE files SET {} WHERE id = ?".format(
+                    ", ".join(c + " = ?" for c in changes)),
+                    list(changes.values()) + [file_id])
+            if "name" in changes:
+                self.index_name(db, file_id, name)
+            if removed:
+                db.executemany(
+                    "DELETE FROM file_tags WHERE file_id = ? AND tag_name = ?",
+                    [(file_id, tag) for tag in removed])
+            if added:
+                self.insert_tags(db, added, file_id)
+            db.bump_generation()
+            if "category_name" in changes or removed:
+                # the old category or tags may be gone
+                self._vocabulary.rebuild(db)
+            else:
+                self._vocabulary.add(db, tags=added)
+        return True
+
+    @staticmethod
+    def tag_diff(current, old_category, new_category, tags=None,
+                 add_tags=None, rm_tags=None):
+        """Return the set of tags a file has after a modification."""
+        old_letter = old_category[0].lower()
+        new_letter = new_category[0].lower()
+        if tags:
+            new_tags = set(tag.lower() for tag in tags)
+        else:
+            new_tags = set(current)
+            if old_letter != new_letter:
+                new_tags.discard(old_letter)
+        new_tags.add(new_letter)
+        new_tags.update(tag.lower() for tag in add_tags or [])
+        new_tags.difference_update(tag.lower() for tag in rm_tags or [])
+        return new_tags
+
+    def import_files(self, records, batch_size=1000):
+        """Add files in batches, every batch in a single transaction.
+
+        An invalid record raises ValueError telling how many files the
+        batches before it added.
+        """
+        count = 0
+        with DatabaseManager() as db:
+            try:
+                for batch in chunks(records, batch_size):
+                    db.execute("BEGIN IMMEDIATE")
+                    self.insert_batch(db, batch)
+                    db.commit()
+                    count += len(batch)
+            except ValueError as error:
+                raise ValueError("{} ({} files imported before it)".format(
+                    error, count)) from None
+        return count
+
+    @staticmethod
+    def insert_batch(db, records):
+        """Insert a list of file records with one statement per table.
+
+        Ids are assigned here so file_tags rows can be built without a
+        round trip per file, the caller must hold the write lock.
+        """
+        cursor = db.execute("""
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence
+                          WHERE name='files'), 0),
+                COALESCE((SELECT MAX(id) FROM files), 0))
+        """)
+        last_id = cursor.fetchone()[0]
+
+        files = []
+        categories = set()
+        file_tags = set()
+        for file_id, record in enumerate(records, last_id + 1):
+            name = record["name"]
+            category = record["category"]
+            if not name or not category:
+                raise ValueError(
+                    "record without name or category: {}".format(record))
+            files.append((file_id, name, category, record["description"]))
+            categories.add((category,))
+            tags = [tag.lower() for tag in record["tags"]]
+            tags.append(category[0].lower())
+            file_tags.update((file_id, tag) for tag in tags)
+
+        db.executemany("INSERT OR IGNORE INTO categories(name) values(?)",
+                       categories)
+        db.executemany("INSERT OR IGNORE INTO tags values(?)",
+                       {(tag,) for _, tag in file_tags})
+        db.executemany(
+            "INSERT INTO files(id, name, category_name, desc) "
+            "values(?, ?, ?, ?)", files)
+        db.executemany(
+            "INSERT INTO file_tags(file_id, tag_name) values(?, ?)",
+            file_tags)
+        db.executemany(
+            "INSERT INTO file_trigrams(trigram, file_id) values(?, ?)",
+            ((gram, file_id) for file_id, name, _, _ in files
+             for gram in trigrams(name)))
+        db.bump_generation()
+        Vocabulary().add(db, [category for category, in categories],
+                         [tag for _, tag in file_tags])
+
+    def cache_stats(self):
+        """Return the query cache counters."""
+        return self._cache.stats()
+
+    def clear_cache(self):
+        """Drop cached query results."""
+        self._cache.clear()
 
     @staticmethod
     def insert_tags(db, tags, file_id):
         """Handle new tag insertion."""
+        tags = set(tag.lower() for tag in tags)
         tags_tuple_list = [(tag,) for tag in tags]
         # insert or ignore if exists
         db.executemany("INSERT OR IGNORE INTO tags values(?)", tags_tuple_list)
+        db.executemany("INSERT INTO file_tags(file_id, tag_name) values(?, ?)",
+                       [(file_id, tag) for tag in tags])
 
-        for tag in tags:
-            db.execute("INSERT INTO file_tags(file_id, tag_name) values(?, ?)",
-                       (file_id, tag.lower()))
+    @staticmethod
+    def index_name(db, file_id, name):
+        """Replace the trigrams of the name of a file."""
+        db.execute("DELETE FROM file_trigrams WHERE file_id=?", (file_id,))
+        db.executemany(
+            "INSERT INTO file_trigrams(trigram, file_id) values(?, ?)",
+            [(gram, file_id) for gram in trigrams(name)])
 
-    def find_file(self, name, category, description, tags):
+    def find_file(self, name, category, description, tags, limit=None,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
         """Find files."""
-        sql = """
-            SELECT files.id, files.name, files.desc, files.category_name
-            FROM files
-            JOIN file_tags
-                ON files.id=file_tags.file_id
+        return dumps_rows(self.find_rows(name, category, description, tags,
+                                         limit, tag_mode, workers, content,
+                                         fuzzy, order_by, after))
+
+    def iter_find(self, name, category, description, tags, limit=None,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
+        """Yield found files one by one as dicts."""
+        return self.find_rows(name, category, description, tags, limit,
+                              tag_mode, workers, content, fuzzy, order_by,
+                              after).dicts()
+
+    def find_rows(self, name, category, description, tags, limit=None,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
+        """Return found files as Rows, straight from the cursor.
+
+        Files are sorted by order_by, by rank or id if it's None, and only
+        the ones sorted after the file id or cursor after are found. With
+        several workers the files are split in ranges of ids read in
+        parallel. Results are cached unless they have more than max_rows
+        rows. Tags are lists.
         """
-        args = []
+        found = Rows.headed(self._find(name, category, description, tags,
+                                       limit, tag_mode, workers, content,
+                                       fuzzy, order_by, after))
+        # cached rows keep the joined tags, lists would be shared
+        return found.convert("tags", split_tags)
 
-        if name or category or tags or description:
-            sql += " WHERE "
-            multiple = False
-            if name:
-                if multiple:
-                    sql += "AND "
-                sql += "name LIKE ? "
-                name = self.surround(name)
-                args.append(name)
-                multiple = True
-            if description:
-                if multiple:
-                    sql += "AND "
-                sql += "desc LIKE ? "
-                description = self.surround(description)
-                args.append(description)
-                multiple = True
-            if category:
-                if multiple:
-                    sql += "AND "
-                sql += "category_name LIKE ? "
-                category = self.surround(category)
-                args.append(category)
-                multiple = True
-            if tags:
-                if multiple:
-                    sql += "AND "
-                sql += "file_tags.tag_name REGEXP ? "
-                tags = [tag.lower() for tag in tags]
-                tags = '|'.join(tags)
-                args.append(tags)
+    def find_page(self, name, category, description, tags, limit,
+                  tag_mode="any", workers=1, content=None, fuzzy=False,
+                  order_by=None, after=None):
+        """Return up to limit found files as dicts, and the next cursor.
+
+        The cursor finds the next page when passed as after, it's None
+        on the last page. One more file is read to tell if there's one.
+        """
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        page = list(self.iter_find(name, category, description, tags,
+                                   limit + 1, tag_mode, workers, content,
+                                   fuzzy, order_by, after))
+        cursor = None
+        if len(page) > limit:
+            del page[limit:]
+            with DatabaseManager() as db:
+                cursor = self.after_key(
+                    db, page[-1]["id"], name, category, description, tags,
+                    tag_mode, content, fuzzy, order_by)[2]
+        return page, cursor
+
+    def _find(self, name, category, description, tags, limit, tag_mode,
+              workers, content, fuzzy, order_by, after):
+        """Yield the columns of the found files, then their rows."""
+        key = cache_key("find_rows", name, category, description, tags,
+                        limit, tag_mode, content, fuzzy, order_by,
+                        exact=[after])
+        with DatabaseManager() as db:
+            generation = db.generation()
+            cached = self._cache.get(key, generation)
+            if cached is not None:
+                columns, rows = cached
+                yield columns
+                yield from rows
+                return
+
+            after = self.after_key(db, after, name, category, description,
+                                   tags, tag_mode, content, fuzzy,
+                                   order_by)[1]
+            if workers > 1:
+                found = self._parallel_find(db, name, category, description,
+                                            tags, limit, tag_mode, workers,
+                                            content, fuzzy, order_by, after)
+            else:
+                sql, args = self.find_query(name, category, description,
+                                            tags, limit, tag_mode, content,
+                                            fuzzy, order_by, after)
+                found = db.select(sql, args)
+            yield found.columns
+            rows = []
+            for row in found:
+                if rows is not None:
+                    rows.append(row)
+                    if len(rows) > self._cache.max_rows:
+                        rows = None
+                yield row
+            if rows is not None:
+                self._cache.put(key, generation, (found.columns, rows))
+
+    def _parallel_find(self, db, name, category, description, tags, limit,
+                       tag_mode, workers, content, fuzzy, order_by, after):
+        """Return found files reading ranges of ids in parallel.
+
+        Every range is sorted like find_query does and results are merged
+        by their sort key, ranges come in id order so ties stay sorted.
+        """
+        order, sort_key = self.sort_key(name, description, fuzzy, order_by)
+        ranked = order == "rank"
+        columns = FILE_COLUMNS + (", {} AS rank".format(sort_key[0])
+                                  if ranked else "")
+        merge_key = {"rank": "rank", "name": "name",
+                     "category": "category_name"}.get(order)
+
+        def query(low, high):
+            query = self.filter_query(columns, name, category, description,
+                                      tags, tag_mode, content, fuzzy)
+            query.where("files.id BETWEEN ? AND ?", low, high)
+            self.sort_query(query, sort_key, after)
+            if limit is not None:
+                query.limit(limit)
+            return query.build()
 
-        sql += "GROUP BY files.id "
+        # a range of no ids still gives the columns
+        ranges = parallel.id_ranges(db, workers) or [(1, 0)]
+        rows = parallel.read_ranges(query, ranges, merge_key)
+        if ranked:
+            rows = rows.select(rows.columns[:-1])
+        return Rows(rows.columns, islice(rows, limit))
 
-        dict_list = []
+    @staticmethod
+    def stats():
+        """Return how many files, categories and tags there are.
+
+        tag_assignments counts the tags of every file, a file with two
+        tags counts twice. Read from the counter tables, without scanning
+        the files.
+        """
         with DatabaseManager() as db:
-            cursor = db.execute(sql, tuple(args))
-            for row in cursor.fetchall():
-                dict_list.append(dict(row))
-        return json.dumps(dict_list, indent=2)
+            files, categories = db.execute(
+                "SELECT coalesce(sum(files), 0), count(*) "
+                "FROM category_counts").fetchone()
+            tag_assignments, tags = db.execute(
+                "SELECT coalesce(sum(files), 0), count(*) "
+                "FROM tag_counts").fetchone()
+        return {"files": files, "categories": categories, "tags": tags,
+                "tag_assignments": tag_assignments}
+
+    def facets(self, name=None, category=None, description=None, tags=None,
+               tag_mode="any", content=None, top=None):
+        """Return the files per category and per tag of the found files.
+
+        Every facet is a list of [name, count], the most common first, up
+        to top. Without filters the counter tables are read, otherwise
+        only the found files are counted.
+        """
+        key = cache_key("facets", name, category, description, tags,
+                        tag_mode, content, top)
+        filtered = any((name, category, description, tags, content))
+        if filtered:
+            sql, args = self.filter_query("files.id", name, category,
+                                          description, tags, tag_mode,
+                                          content).build()
+        with DatabaseManager() as db:
+            generation = db.generation()
+            facets = self._cache.get(key, generation)
+            if facets is not None:
+                return copy.deepcopy(facets)
+
+            facets = {}
+            for facet, (counts, table, column, id_column) in FACETS.items():
+                if filtered:
+                    query = ("SELECT {1}, count(*) AS files FROM {0} "
+                             "WHERE {2} IN ({3}) GROUP BY {1}").format(
+                                 table, column, id_column, sql)
+                    query_args = args
+                else:
+                    query = "SELECT name, files FROM " + counts
+                    query_args = ()
+                query = "SELECT * FROM ({}) ORDER BY 2 DESC, 1".format(query)
+                if top is not None:
+                    query += " LIMIT ?"
+                    query_args += (top,)
+                facets[facet] = [list(row)
+                                 for row in db.select(query, query_args)]
+            self._cache.put(key, generation, facets)
+        # cached results are shared
+        return copy.deepcopy(facets)
+
+    def explain_find(self, name, category, description, tags, limit=None,
+                     tag_mode="any", content=None, fuzzy=False,
+                     order_by=None, after=None):
+        """Return the query plan of a find as dicts."""
+        with DatabaseManager() as db:
+            after = self.after_key(db, after, name, category, description,
+                                   tags, tag_mode, content, fuzzy,
+                                   order_by)[1]
+            sql, args = self.find_query(name, category, description, tags,
+                                        limit, tag_mode, content, fuzzy,
+                                        order_by, after)
+            return [dict(row) for row in
+                    db.execute("EXPLAIN QUERY PLAN " + sql, args)]
+
+    def find_query(self, name, category, description, tags, limit=None,
+                   tag_mode="any", content=None, fuzzy=False, order_by=None,
+                   after=None):
+        """Build the sql and arguments of a find.
+
+        after is the sort key of the file the results start after.
+        """
+        query = self.filter_query(FILE_COLUMNS, name, category, description,
+                                  tags, tag_mode, content, fuzzy)
+        self.sort_query(query, self.sort_key(name, description, fuzzy,
+                                             order_by)[1], after)
+
+        if limit is not None:
+            query.limit(limit)
+
+        return query.build()
+
+    def sort_key(self, name, description, fuzzy=False, order_by=None):
+        """Return the order of a find and the sql of its sort key.
+
+        Files are sorted by the key ascending. Without order_by ranked
+        searches are sorted by rank, the rest by id.
+        """
+        rank = self.rank(name, description, fuzzy)
+        order = order_by or ("rank" if rank else "id")
+        if order == "rank":
+            if not rank:
+                raise ValueError("only searches by name or description are "
+                                 "ranked")
+            return order, [rank, "files.id"]
+        if order not in ORDERS:
+            raise ValueError("unknown order: " + order)
+        return order, ORDERS[order] + ["files.id"]
+
+    @staticmethod
+    def sort_query(query, sort_key, after=None):
+        """Sort a query by a key, keeping the rows after that key.
+
+        The key is compared as a row value, so indexes on it are used
+        instead of skipping the previous rows.
+        """
+        if after is not None:
+            query.where("({}) > ({})".format(", ".join(sort_key),
+                                             ", ".join("?" * len(sort_key))),
+                        *after)
+        for term in sort_key:
+            query.order_by(term)
+
+    def after_key(self, db, after, name, category, description, tags,
+                  tag_mode, content, fuzzy, order_by):
+        """Return the order, sort key and cursor of the file after.
+
+        after is a file id found with the same filters, or a cursor
+        token. Return None for the key and cursor if after is None.
+        """
+        order, sort_key = self.sort_key(name, description, fuzzy, order_by)
+        if after is None:
+            return order, None, None
+        if isinstance(after, str) and not after.isdigit():
+            try:
+                cursor_order, *key = json.loads(base64.urlsafe_b64decode(
+                    after + "=" * (-len(after) % 4)))
+            except (ValueError, TypeError):
+                raise ValueError("invalid cursor: " + after)
+            if cursor_order != order or len(key) != len(sort_key):
+                raise ValueError("the cursor belongs to other order")
+            return order, key, after
+
+        query = self.filter_query(", ".join(sort_key), name, category,
+                                  description, tags, tag_mode, content,
+                                  fuzzy)
+        query.where("files.id = ?", int(after))
+        row = db.execute(*query.build()).fetchone()
+        if row is None:
+            raise ValueError("file {} isn't found by this search".format(
+                after))
+        key = list(row)
+        cursor = base64.urlsafe_b64encode(
+            json.dumps([order] + key).encode()).decode().rstrip("=")
+        return order, key, cursor
+
+    def rank(self, name, description, fuzzy=False):
+        """Return the sql ranking found files, best first, None if unranked.
+
+        Fuzzy names rank by similarity, full text searches by relevance.
+        """
+        if fuzzy and trigrams(name or ""):
+            return "-fuzzy.score"
+        if self.fts_query({"name": name, "desc": description}):
+            return "fts.rank"
+        return None
+
+    def filter_query(self, columns, name=None, category=None,
+                     description=None, tags=None, tag_mode="any",
+                     content=None, fuzzy=False):
+        """Return a query builder of the files matching the filters.
+
+        Name and description are searched in the full text index, results
+        are then ranked by relevance (bm25) and prefix matched. content
+        is searched the same way in the text of the attached documents.
+
+        With fuzzy, names having MIN_SIMILARITY of the trigrams of name are
+        found, so typos are tolerated, and ranked by similarity.
+
+        Tags are matched exactly, files having "any" or "all" of them, or
+        as a regular expression when tag_mode is "regex", raising
+        ValueError if it's invalid.
+        """
+        query = QueryBuilder(columns, "files")
+
+        grams = sorted(trigrams(name)) if fuzzy and name else []
+        if grams:
+            query.join(FUZZY.format(", ".join("?" * len(grams))),
+                       len(grams), len(grams), *grams,
+                       math.ceil(len(grams) * MIN_SIMILARITY))
+            name = None
+
+        match = self.fts_query({"name": name, "desc": description})
+        if match:
+            query.join("""
+                JOIN (SELECT rowid, rank FROM files_fts
+                      WHERE files_fts MATCH ?) AS fts
+                    ON files.id=fts.rowid
+            """, match)
+        elif match is None:
+            query.where("0")
+
+        text_match = self.fts_query({"text": content})
+        if text_match:
+            query.where(DOCUMENTED, text_match)
+        elif text_match is None:
+            query.where("0")
+
+        if category:
+            query.where("files.category_name LIKE ?", self.surround(category))
+
+        if tags:
+            tags = [tag.lower() for tag in tags]
+            if tag_mode == "regex":
+                pattern = '|'.join(tags)
+                try:
+                    compile_regexp(pattern)
+                except re.error as error:
+                    raise ValueError("invalid regex {}: {}".format(
+                        pattern, error)) from None
+                query.where(TAGGED.format("tag_name REGEXP ?"), pattern)
+            elif tag_mode == "all":
+                for tag in sorted(set(tags)):
+                    query.where(TAGGED.format("tag_name = ?"), tag)
+            else:
+                tags = sorted(set(tags))
+                query.where(TAGGED.format("tag_name IN ({})".format(
+                    ", ".join("?" * len(tags)))), *tags)
+
+        return query
+
+    @staticmethod
+    def fts_query(columns):
+        """Build a full text query from a dict of column: text.
+
+        Every word becomes a quoted prefix term, so "tax rep" matches
+        "tax report"; all the terms of all the columns must match.
+
+        Return None if the text of a column has no words, as no file
+        can match it.
+        """
+        parts = []
+        for column, text in columns.items():
+            if not text:
+                continue
+            words = re.findall(r"\w+", text)
+            if not words:
+                return None
+            terms = " ".join('"{}"*'.format(w) for w in words)
+            parts.append("{} : ({})".format(column, terms))
+        return " AND ".join(parts)
 
     @staticmethod
     def surround(string, surround_text='%'):
@@ -148,32 +856,27 @@ class FileManager(Borg):
 
     def get_info(self, file_id):
         """Get all info about a file."""
-        with DatabaseManager() as db:
-            sql = """
-                SELECT files.id, files.name, files.desc, files.category_name
-                FROM files
-                JOIN file_tags
-                    ON files.id=file_tags.file_id
-                WHERE files.id=?
-            """
+        return json.dumps(self.info(file_id), indent=2)
 
-            cursor = db.execute(sql, (file_id,))
+    def info(self, file_id):
+        """Return all info about a file as a dict, empty if it's missing."""
+        query = QueryBuilder(FILE_COLUMNS, "files")
+        query.where("files.id = ?", file_id)
+        sql, args = query.build()
+        key = cache_key("show", file_id)
 
-            result = cursor.fetchone()
+        with DatabaseManager() as db:
+            generation = db.generation()
+            result = self._cache.get(key, generation)
+            if result is None:
+                result = db.execute(sql, args).fetchone()
+                if not result:
+                    result = {}
+                else:
+                    result = dict(result)
+                    result["tags"] = split_tags(result["tags"])
+                    result["attachments"] = self.attachments(db, file_id)
+                self._cache.put(key, generation, result)
 
-            if not result:
-                result = {}
-            else:
-                result = dict(result)
-
-                sql = """
-                    SELECT tag_name
-                    FROM file_tags
-                    WHERE file_id=?
-                """
-                result["tags"] = []
-                cursor = db.execute(sql, (file_id,))
-                for row in cursor.fetchall():
-                    result["tags"].append(dict(row)["tag_name"])
-
-            return json.dumps(result, indent=2)
+        # cached results are shared
+        return copy.deepcopy(result)
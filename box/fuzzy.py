@@ -0,0 +1,19 @@
+"""Trigrams of file names, for finding them despite typos."""
+
+import re
+
+# names having a smaller share of the trigrams searched aren't found
+MIN_SIMILARITY = 0.5
+
+
+def trigrams(text):
+    """Return the set of trigrams of a text.
+
+    Every word is lowercased and padded, so "Tax" gives "  t", " ta",
+    "tax" and "ax ". Short words and word starts still match this way.
+    """
+    grams = set()
+    for word in re.findall(r"\w+", text.lower()):
+        word = "  " + word + " "
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
@@ -0,0 +1,179 @@
+"""Extraction of the text of attached documents into the full text index."""
+
+import os
+import time
+
+from db_manager import DatabaseManager
+from extractors import extract, find_extractor
+
+# extractions failing this many times aren't retried
+MAX_ATTEMPTS = 3
+# documents claimed per worker at a time
+CLAIM_PER_WORKER = 4
+
+
+class Indexer(object):
+    """Extracts queued documents in a process pool and indexes their text.
+
+    The queue is the extract_queue table, attaching a document queues it.
+    Documents are claimed before their extraction and every result is
+    committed as it arrives, so an interrupted run resumes where it
+    stopped.
+    """
+
+    def __init__(self, blob_store, workers=None):
+        """Constructor."""
+        self.blob_store = blob_store
+        self.workers = workers or os.cpu_count() or 1
+
+    def run(self, retry_failed=False):
+        """Extract every pending document.
+
+        Return how many documents were indexed, failed and skipped.
+        """
+        # process pools are slow to import, most commands don't index
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        counts = {"indexed": 0, "failed": 0, "skipped": 0}
+        with DatabaseManager() as db:
+            # claimed by a run that was interrupted
+            db.execute("UPDATE extract_queue SET state='pending' "
+                       "WHERE state='running'")
+            if retry_failed:
+                db.execute("UPDATE extract_queue SET state='pending', "
+                           "attempts=0 WHERE state='failed'")
+
+        with ProcessPoolExecutor(self.workers) as executor:
+            while True:
+                batch = self._claim(self.workers * CLAIM_PER_WORKER)
+                if not batch:
+                    break
+                futures = {}
+                for digest, mime in batch:
+                    if find_extractor(mime) is None:
+                        self._skip(digest, mime)
+                        counts["skipped"] += 1
+                        continue
+                    future = executor.submit(extract,
+                                             self.blob_store.path(digest),
+                                             mime)
+                    futures[future] = digest
+                for future in as_completed(futures):
+                    digest = futures[future]
+                    try:
+                        text, seconds = future.result()
+                    except Exception as error:
+                        if self._fail(digest, error):
+                            counts["failed"] += 1
+                    else:
+                        self._store(digest, text, seconds)
+                        counts["indexed"] += 1
+        return counts
+
+    @staticmethod
+    def _claim(count):
+        """Mark up to count pending documents as running, return them.
+
+        Every document comes with the mime type it was attached with.
+        """
+        with DatabaseManager() as db:
+            db.execute("BEGIN IMMEDIATE")
+            batch = list(db.select("""
+                SELECT hash, (SELECT mime FROM attachments
+                              WHERE attachments.hash=extract_queue.hash
+                              LIMIT 1)
+                FROM extract_queue WHERE state='pending'
+                ORDER BY queued_at LIMIT ?
+            """, (count,)))
+            db.executemany("UPDATE extract_queue SET state='running', "
+                           "attempts=attempts + 1 WHERE hash=?",
+                           [(digest,) for digest, _ in batch])
+        return batch
+
+    @staticmethod
+    def _store(digest, text, seconds):
+        """Index the text of a document."""
+        with DatabaseManager() as db:
+            # replace would skip the delete trigger of the index
+            db.execute("DELETE FROM document_text WHERE hash=?", (digest,))
+            db.execute("INSERT INTO document_text(hash, text) VALUES (?, ?)",
+                       (digest, text))
+            db.execute("UPDATE extract_queue SET state='done', error=NULL, "
+                       "done_at=?, seconds=? WHERE hash=?",
+                       (time.time(), seconds, digest))
+            db.bump_generation()
+
+    @staticmethod
+    def _fail(digest, error):
+        """Queue a document again, or give up after MAX_ATTEMPTS.
+
+        Return if it was given up.
+        """
+        with DatabaseManager() as db:
+            row = db.execute("SELECT attempts FROM extract_queue "
+                             "WHERE hash=?", (digest,)).fetchone()
+            if row is None:
+                return False
+            state = "pending" if row[0] < MAX_ATTEMPTS else "failed"
+            db.execute("UPDATE extract_queue SET state=?, error=? "
+                       "WHERE hash=?",
+                       (state, "{}: {}".format(type(error).__name__, error),
+                        digest))
+        return state == "failed"
+
+    @staticmethod
+    def _skip(digest, mime):
+        """Mark a document without an extractor for its type."""
+        with DatabaseManager() as db:
+            db.execute("UPDATE extract_queue SET state='skipped', error=? "
+                       "WHERE hash=?",
+                       ("no extractor for {}".format(mime), digest))
+
+    @staticmethod
+    def prune():
+        """Forget the text of documents no file refers to anymore."""
+        with DatabaseManager() as db:
+            db.execute("DELETE FROM document_text WHERE hash NOT IN "
+                       "(SELECT hash FROM attachments)")
+            db.execute("DELETE FROM extract_queue WHERE hash NOT IN "
+                       "(SELECT hash FROM attachments)")
+
+    @staticmethod
+    def failures():
+        """Return the names and errors of the documents given up."""
+        with DatabaseManager() as db:
+            return list(db.select("""
+                SELECT (SELECT group_concat(DISTINCT name) FROM attachments
+                        WHERE attachments.hash=extract_queue.hash), error
+                FROM extract_queue WHERE state IN ('failed', 'skipped')
+                ORDER BY queued_at
+            """))
+
+    @staticmethod
+    def status():
+        """Return the backlog of the queue and the extraction throughput."""
+        with DatabaseManager() as db:
+            states = dict(db.select(
+                "SELECT state, count(*) FROM extract_queue GROUP BY state"))
+            backlog_bytes = db.execute("""
+                SELECT coalesce(sum(size), 0) FROM (
+                    SELECT DISTINCT attachments.hash, size FROM attachments
+                    JOIN extract_queue ON extract_queue.hash=attachments.hash
+                    WHERE state IN ('pending', 'running'))
+            """).fetchone()[0]
+            done, seconds, first, last = db.execute("""
+                SELECT count(*), sum(seconds), min(done_at), max(done_at)
+                FROM extract_queue WHERE state='done' AND done_at > ?
+            """, (time.time() - 3600,)).fetchone()
+
+        status = {state: states.get(state, 0) for state in
+                  ("pending", "running", "done", "failed", "skipped")}
+        status["backlog_bytes"] = backlog_bytes
+        status["done_last_hour"] = done
+        # time spent by the workers, and wall clock time of the last hour
+        status["seconds_per_document"] = (round(seconds / done, 4)
+                                          if done else None)
+        status["documents_per_second"] = (round(done / (last - first), 2)
+                                          if done > 1 and last > first
+                                          else None)
+        return status
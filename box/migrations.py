@@ -0,0 +1,323 @@
+"""Database schema migrations.
+
+Each migration is a list of sql statements applied in one transaction,
+or functions taking the connection for data sqlite can't compute.
+The version of a database is the number of migrations applied to it,
+stored in PRAGMA user_version. Statements are idempotent so databases
+created before versioning existed can be migrated from version 0.
+"""
+
+from fuzzy import trigrams
+
+
+def index_names(db):
+    """Fill file_trigrams with the trigrams of every file name."""
+    names = db.execute("SELECT id, name FROM files").fetchall()
+    db.executemany(
+        "INSERT OR IGNORE INTO file_trigrams(trigram, file_id) VALUES (?, ?)",
+        ((gram, file_id) for file_id, name in names
+         for gram in trigrams(name)))
+
+
+MIGRATIONS = [
+    # 1: base tables
+    [
+        """
+        CREATE TABLE if not exists categories (
+            name TEXT PRIMARY KEY NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE if not exists tags (
+            name TEXT PRIMARY KEY NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE if not exists files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            name TEXT NOT NULL,
+            desc TEXT,
+            category_name TEXT NOT NULL,
+
+            FOREIGN KEY(category_name)
+                REFERENCES categories(name)
+        );
+        """,
+        """
+        CREATE TABLE if not exists file_tags (
+            file_id INTEGER NOT NULL,
+            tag_name TEXT NOT NULL,
+
+            PRIMARY KEY(file_id, tag_name),
+
+            FOREIGN KEY(file_id)
+                REFERENCES files(id)
+                ON DELETE CASCADE,
+            FOREIGN KEY(tag_name)
+                REFERENCES tags(name)
+                ON UPDATE CASCADE
+                ON DELETE CASCADE
+        );
+        """,
+    ],
+    # 2: secondary indexes
+    [
+        """
+        CREATE INDEX if not exists file_tags_tag_name
+            ON file_tags(tag_name, file_id);
+        """,
+        """
+        CREATE INDEX if not exists files_category_name
+            ON files(category_name);
+        """,
+    ],
+    # 3: full text index over files, an external content table kept in
+    # sync by triggers and backfilled with a rebuild
+    [
+        """
+        CREATE VIRTUAL TABLE if not exists files_fts USING fts5(
+            name,
+            desc,
+            content='files',
+            content_rowid='id'
+        );
+        """,
+        """
+        CREATE TRIGGER if not exists files_fts_insert
+        AFTER INSERT ON files BEGIN
+            INSERT INTO files_fts(rowid, name, desc)
+                VALUES (new.id, new.name, new.desc);
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists files_fts_delete
+        AFTER DELETE ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, name, desc)
+                VALUES ('delete', old.id, old.name, old.desc);
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists files_fts_update
+        AFTER UPDATE OF name, desc ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, name, desc)
+                VALUES ('delete', old.id, old.name, old.desc);
+            INSERT INTO files_fts(rowid, name, desc)
+                VALUES (new.id, new.name, new.desc);
+        END;
+        """,
+        "INSERT INTO files_fts(files_fts) VALUES ('rebuild')",
+    ],
+    # 4: metadata, generation is bumped by every write so cached results
+    # can tell they are stale
+    [
+        """
+        CREATE TABLE if not exists box_meta (
+            key TEXT PRIMARY KEY NOT NULL,
+            value INTEGER NOT NULL
+        );
+        """,
+        "INSERT OR IGNORE INTO box_meta(key, value) VALUES ('generation', 0)",
+    ],
+    # 5: attached documents, their contents are in the blob store
+    [
+        """
+        CREATE TABLE if not exists attachments (
+            file_id INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mime TEXT,
+
+            PRIMARY KEY(file_id, hash),
+
+            FOREIGN KEY(file_id)
+                REFERENCES files(id)
+                ON DELETE CASCADE
+        );
+        """,
+        """
+        CREATE INDEX if not exists attachments_hash
+            ON attachments(hash);
+        """,
+    ],
+    # 6: text extracted from the attached documents, its full text index
+    # and the queue of documents waiting for extraction
+    [
+        """
+        CREATE TABLE if not exists document_text (
+            id INTEGER PRIMARY KEY NOT NULL,
+            hash TEXT UNIQUE NOT NULL,
+            text TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE VIRTUAL TABLE if not exists documents_fts USING fts5(
+            text,
+            content='document_text',
+            content_rowid='id'
+        );
+        """,
+        """
+        CREATE TRIGGER if not exists documents_fts_insert
+        AFTER INSERT ON document_text BEGIN
+            INSERT INTO documents_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists documents_fts_delete
+        AFTER DELETE ON document_text BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, text)
+                VALUES ('delete', old.id, old.text);
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists documents_fts_update
+        AFTER UPDATE OF text ON document_text BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, text)
+                VALUES ('delete', old.id, old.text);
+            INSERT INTO documents_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+        """,
+        """
+        CREATE TABLE if not exists extract_queue (
+            hash TEXT PRIMARY KEY NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            queued_at REAL NOT NULL,
+            done_at REAL,
+            seconds REAL
+        );
+        """,
+        """
+        CREATE INDEX if not exists extract_queue_state
+            ON extract_queue(state);
+        """,
+        """
+        CREATE TRIGGER if not exists extract_queue_attachment
+        AFTER INSERT ON attachments BEGIN
+            INSERT OR IGNORE INTO extract_queue(hash, queued_at)
+                VALUES (new.hash, (julianday('now') - 2440587.5) * 86400);
+        END;
+        """,
+        """
+        INSERT OR IGNORE INTO extract_queue(hash, queued_at)
+            SELECT DISTINCT hash, (julianday('now') - 2440587.5) * 86400
+            FROM attachments;
+        """,
+    ],
+    # 7: files per category and per tag, counters kept by triggers so
+    # listing them doesn't scan the files
+    [
+        """
+        CREATE TABLE if not exists category_counts (
+            name TEXT PRIMARY KEY NOT NULL,
+            files INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        """,
+        """
+        CREATE TABLE if not exists tag_counts (
+            name TEXT PRIMARY KEY NOT NULL,
+            files INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        """,
+        """
+        CREATE TRIGGER if not exists category_counts_insert
+        AFTER INSERT ON files BEGIN
+            INSERT INTO category_counts(name, files)
+                VALUES (new.category_name, 1)
+                ON CONFLICT(name) DO UPDATE SET files = files + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists category_counts_delete
+        AFTER DELETE ON files BEGIN
+            UPDATE category_counts SET files = files - 1
+                WHERE name = old.category_name;
+            DELETE FROM category_counts
+                WHERE name = old.category_name AND files <= 0;
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists category_counts_update
+        AFTER UPDATE OF category_name ON files
+        WHEN old.category_name IS NOT new.category_name BEGIN
+            UPDATE category_counts SET files = files - 1
+                WHERE name = old.category_name;
+            DELETE FROM category_counts
+                WHERE name = old.category_name AND files <= 0;
+            INSERT INTO category_counts(name, files)
+                VALUES (new.category_name, 1)
+                ON CONFLICT(name) DO UPDATE SET files = files + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists tag_counts_insert
+        AFTER INSERT ON file_tags BEGIN
+            INSERT INTO tag_counts(name, files) VALUES (new.tag_name, 1)
+                ON CONFLICT(name) DO UPDATE SET files = files + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists tag_counts_delete
+        AFTER DELETE ON file_tags BEGIN
+            UPDATE tag_counts SET files = files - 1
+                WHERE name = old.tag_name;
+            DELETE FROM tag_counts WHERE name = old.tag_name AND files <= 0;
+        END;
+        """,
+        """
+        CREATE TRIGGER if not exists tag_counts_update
+        AFTER UPDATE OF tag_name ON file_tags
+        WHEN old.tag_name IS NOT new.tag_name BEGIN
+            UPDATE tag_counts SET files = files - 1
+                WHERE name = old.tag_name;
+            DELETE FROM tag_counts WHERE name = old.tag_name AND files <= 0;
+            INSERT INTO tag_counts(name, files) VALUES (new.tag_name, 1)
+                ON CONFLICT(name) DO UPDATE SET files = files + 1;
+        END;
+        """,
+        "DELETE FROM category_counts",
+        """
+        INSERT INTO category_counts(name, files)
+            SELECT category_name, count(*) FROM files GROUP BY category_name;
+        """,
+        "DELETE FROM tag_counts",
+        """
+        INSERT INTO tag_counts(name, files)
+            SELECT tag_name, count(*) FROM file_tags GROUP BY tag_name;
+        """,
+    ],
+    # 8: trigrams of the file names, filled by the file manager
+    [
+        """
+        CREATE TABLE if not exists file_trigrams (
+            trigram TEXT NOT NULL,
+            file_id INTEGER NOT NULL,
+
+            PRIMARY KEY(trigram, file_id),
+
+            FOREIGN KEY(file_id)
+                REFERENCES files(id)
+                ON DELETE CASCADE
+        ) WITHOUT ROWID;
+        """,
+        """
+        CREATE INDEX if not exists file_trigrams_file_id
+            ON file_trigrams(file_id);
+        """,
+        index_names,
+    ],
+    # 9: sorting by name, files are paged through the (name, id) index
+    [
+        """
+        CREATE INDEX if not exists files_name ON files(name);
+        """,
+    ],
+    # 10: random id of the database, so a database created again at the
+    # same path doesn't share the cached results of the old one
+    [
+        "INSERT OR IGNORE INTO box_meta(key, value) "
+        "VALUES ('database_id', random())",
+    ],
+]
@@ -0,0 +1,197 @@
+"""Read queries split by ranges of file ids and run in parallel.
+
+Every range is read by its own read only connection, so sqlite works on
+several cores at once, and the results are merged in order.
+"""
+
+import heapq
+import re
+import sqlite3
+
+from operator import itemgetter
+from textwrap import indent
+from urllib.parse import quote
+
+from config import ConfigManager
+from db_manager import regexp
+from rows import Rows
+from utilities import dumps_rows
+
+# pragmas that can't be set on a read only connection
+WRITE_PRAGMAS = ("journal_mode", "synchronous")
+# clauses whose rows depend on every range, so ranges can't be
+# concatenated; words in strings or names only make the query run whole
+WHOLE_CLAUSES = re.compile(r"\b(ORDER|LIMIT|OFFSET|GROUP|HAVING|DISTINCT|"
+                           r"UNION|INTERSECT|EXCEPT|OVER|WINDOW)\b", re.I)
+# opcodes of aggregate and window functions, count(*) becomes Count
+AGGREGATE_OPCODES = {"AggStep", "AggStep1", "AggFinal", "AggValue",
+                     "AggInverse", "Count"}
+# opcodes opening a cursor on a table or index
+OPEN_OPCODES = ("OpenRead", "ReopenIdx")
+# query plan steps reading a table apart from the rows of the query
+NESTED_STEPS = re.compile(r"SUBQUERY|^MATERIALIZE|^CO-ROUTINE")
+
+
+def read_only_connection():
+    """Return a read only connection to the database, rows are tuples."""
+    config = ConfigManager()
+    uri = "file:{}?mode=ro".format(quote(config.database_path))
+    db = sqlite3.connect(uri, uri=True)
+    db.create_function("REGEXP", 2, regexp)
+    for pragma, value in config.pragmas.items():
+        if pragma not in WRITE_PRAGMAS:
+            db.execute("PRAGMA {} = {}".format(pragma, value))
+    return db
+
+
+def id_ranges(db, parts):
+    """Split the ids of the files in at most parts inclusive ranges."""
+    low, high = db.execute("SELECT min(id), max(id) FROM files").fetchone()
+    if low is None:
+        return []
+    size = -(-(high - low + 1) // parts)
+    return [(start, min(start + size - 1, high))
+            for start in range(low, high + 1, size)]
+
+
+def splittable(db, sql):
+    """Return if a query reads files and can be split in ranges of ids.
+
+    Its rows can't depend on other ranges: aggregates, sorting, limits,
+    distinct and compound selects need the whole query run at once. The
+    range hides every reference to files, so files must be read once and
+    not from a subquery, a self join would only pair files of one range.
+    """
+    if WHOLE_CLAUSES.search(sql):
+        return False
+    # compiled but not run
+    program = db.execute("EXPLAIN " + sql).fetchall()
+    if set(row[1] for row in program) & AGGREGATE_OPCODES:
+        return False
+    if any(NESTED_STEPS.search(row[3])
+           for row in db.execute("EXPLAIN QUERY PLAN " + sql)):
+        return False
+    return files_reads(db, program) == 1
+
+
+def files_reads(db, program):
+    """Return how many times the bytecode of a query reads files.
+
+    Every cursor on the table or a covering index is a read, an index
+    cursor locating the rows of a table cursor is part of its read.
+    """
+    roots = dict(db.execute(
+        "SELECT rootpage, type FROM sqlite_master "
+        "WHERE tbl_name='files' AND type IN ('table', 'index')"))
+    tables = set()
+    indexes = set()
+    seeks = set()
+    for row in program:
+        opcode, p1, p2, p3 = row[1:5]
+        if opcode in OPEN_OPCODES and p2 in roots:
+            (tables if roots[p2] == "table" else indexes).add(p1)
+        elif opcode == "DeferredSeek":
+            seeks.add((p1, p3))
+    covering = [index for index in indexes
+                if not any((index, table) in seeks for table in tables)]
+    return len(tables) + len(covering)
+
+
+def files_in_range(sql, low, high):
+    """Return sql reading only the files with ids from low to high.
+
+    A common table expression named files hides the files table.
+    """
+    cte = "files AS (SELECT * FROM main.files WHERE id BETWEEN {} AND {})"
+    cte = cte.format(int(low), int(high))
+    stripped = sql.lstrip()
+    if stripped[:4].upper() == "WITH":
+        rest = stripped[4:].lstrip()
+        if rest[:9].upper() == "RECURSIVE":
+            return "WITH RECURSIVE {}, {}".format(cte, rest[9:].lstrip())
+        return "WITH {}, {}".format(cte, rest)
+    return "WITH {} {}".format(cte, sql)
+
+
+def _read_range(sql, args):
+    """Return the columns and the rows of a query."""
+    db = read_only_connection()
+    try:
+        cursor = db.execute(sql, args)
+        return [d[0] for d in cursor.description], cursor.fetchall()
+    finally:
+        db.close()
+
+
+def _encode_range(sql, low, high):
+    """Return the rows of a range as a fragment of a json list."""
+    rows = Rows(*_read_range(files_in_range(sql, low, high), ()))
+    return ",\n".join(indent(item, "  ") for item in rows.iter_json(2))
+
+
+def read_ranges(query, ranges, key=None):
+    """Return the Rows of query over every range, using a thread each.
+
+    query(low, high) returns the sql and arguments of a range. Rows come
+    range after range, or merged by the key column when every range is
+    sorted by it.
+    """
+    return Rows.headed(_iter_ranges(query, ranges, key))
+
+
+def _iter_ranges(query, ranges, key):
+    """Yield the columns of the ranges, then their rows."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(len(ranges)) as executor:
+        futures = [executor.submit(_read_range, *query(low, high))
+                   for low, high in ranges]
+        columns = futures[0].result()[0]
+        yield columns
+        if key:
+            yield from heapq.merge(*(f.result()[1] for f in futures),
+                                   key=itemgetter(columns.index(key)))
+        else:
+            for future in futures:
+                yield from future.result()[1]
+
+
+def select_rows(sql, workers):
+    """Return the Rows of a select over files, split in ranges.
+
+    Queries that can't be split are read whole.
+    """
+    db = read_only_connection()
+    try:
+        ranges = id_ranges(db, workers) if splittable(db, sql) else None
+    finally:
+        db.close()
+    if not ranges:
+        return read_ranges(lambda low, high: (sql, ()), [(None, None)])
+    return read_ranges(
+        lambda low, high: (files_in_range(sql, low, high), ()), ranges)
+
+
+def select_json(sql, workers):
+    """Return the rows of a select over files as a json list.
+
+    Ranges are read and encoded in worker processes, the result is the
+    same as utilities.dumps_rows. Queries that can't be split are read
+    whole.
+    """
+    # slow to import, most commands read with one worker
+    from concurrent.futures import ProcessPoolExecutor
+
+    db = read_only_connection()
+    try:
+        ranges = id_ranges(db, workers) if splittable(db, sql) else None
+        if not ranges:
+            return dumps_rows(Rows.from_cursor(db.execute(sql)))
+    finally:
+        db.close()
+    lows, highs = zip(*ranges)
+    with ProcessPoolExecutor(len(ranges)) as executor:
+        fragments = executor.map(_encode_range, [sql] * len(ranges), lows,
+                                 highs)
+        body = ",\n".join(f for f in fragments if f)
+    return "[\n" + body + "\n]" if body else "[]"
@@ -0,0 +1,101 @@
+"""Query results as tuples sharing one header."""
+
+import json
+
+from itertools import chain
+
+_encode = json.JSONEncoder().encode
+
+
+class Rows(object):
+    """Iterable of tuple rows and the names of their columns.
+
+    Lighter than a dict per row, the formatters and json writers take
+    them as they are.
+    """
+
+    __slots__ = ("columns", "_rows")
+
+    def __init__(self, columns, rows):
+        """Constructor."""
+        self.columns = tuple(columns)
+        self._rows = iter(rows)
+
+    def __iter__(self):
+        """Iterate the rows, once."""
+        return self._rows
+
+    @classmethod
+    def headed(cls, items):
+        """Return rows of an iterable yielding the columns first."""
+        items = iter(items)
+        return cls(next(items, ()), items)
+
+    @classmethod
+    def from_cursor(cls, cursor):
+        """Return rows of an executed cursor."""
+        return cls((d[0] for d in cursor.description or ()), cursor)
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        """Return rows of an iterable of dicts with the same keys."""
+        dicts = iter(dicts)
+        first = next(dicts, None)
+        if first is None:
+            return cls((), ())
+        columns = tuple(first)
+        return cls(columns, (tuple(d[c] for c in columns)
+                             for d in chain([first], dicts)))
+
+    def peek(self):
+        """Return the first row without consuming it, None if empty."""
+        first = next(self._rows, None)
+        if first is not None:
+            self._rows = chain([first], self._rows)
+        return first
+
+    def close(self):
+        """Stop reading the rows, closing their source if it's a generator.
+
+        A find left unfinished keeps its statement and connection until
+        its generator is closed.
+        """
+        close = getattr(self._rows, "close", None)
+        if close:
+            close()
+
+    def dicts(self):
+        """Yield every row as a dict."""
+        columns = self.columns
+        for row in self._rows:
+            yield dict(zip(columns, row))
+
+    def convert(self, column, function):
+        """Return rows with the values of a column passed to function."""
+        index = self.columns.index(column)
+        return Rows(self.columns, (
+            tuple(function(value) if i == index else value
+                  for i, value in enumerate(row))
+            for row in self._rows))
+
+    def select(self, columns):
+        """Return rows with only the given columns, in that order."""
+        indices = [self.columns.index(c) for c in columns]
+        return Rows(columns, (tuple(row[i] for i in indices)
+                              for row in self._rows))
+
+    def iter_json(self, indent=None):
+        """Yield every row encoded like json.dumps of its dict would be.
+
+        With indent only the keys are indented, list values stay on one
+        line.
+        """
+        keys = [_encode(c) + ": " for c in self.columns]
+        if indent is None:
+            start, separator, end = "{", ", ", "}"
+        else:
+            pad = " " * indent
+            start, separator, end = "{\n" + pad, ",\n" + pad, "\n}"
+        for row in self._rows:
+            yield start + separator.join(
+                key + _encode(value) for key, value in zip(keys, row)) + end
@@ -0,0 +1,161 @@
+"""Box daemon, answers facade requests over a unix socket.
+
+The protocol is one json object per line. A request is
+{"method": name, "args": [...]} and it's answered with {"result": value},
+or for methods yielding rows with one {"row": row} line per row followed
+by {"done": true}. Rows are preceded by a {"columns": [...]} line and
+sent as lists. Failures are answered with {"error": message}.
+"""
+
+import asyncio
+import json
+import os
+import socket
+
+from concurrent.futures import ThreadPoolExecutor
+
+from aio import iter_in_thread
+from config import ConfigManager
+from db_manager import DatabaseManager
+from facade import Facade
+from rows import Rows
+
+# methods returning a single value
+CALLS = ("add_file", "rm_file", "mod_file", "get_info", "cache_stats",
+         "clear_cache", "stats", "facets", "find_page")
+# methods yielding rows, or returning Rows sent after their columns
+STREAMS = ("iter_find_file", "find_rows", "explain_find_file")
+# methods run one at a time
+WRITES = ("add_file", "rm_file", "mod_file")
+
+
+def encode(message):
+    """Return a message as a json line."""
+    return (json.dumps(message) + "\n").encode()
+
+
+class Server(object):
+    """Keeps a facade and warm connections resident between requests."""
+
+    def __init__(self, path=None, workers=4):
+        """Constructor."""
+        self._config = ConfigManager()
+        self.path = path or self._config.socket_path
+        self._facade = Facade()
+        # worker threads keep their connection open
+        self._executor = ThreadPoolExecutor(
+            workers, initializer=DatabaseManager().keep_open)
+        self._write_lock = None
+
+    def serve_forever(self):
+        """Serve requests until interrupted."""
+        self._facade.migrate()
+        self._remove_stale_socket()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._executor.shutdown(wait=False)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _remove_stale_socket(self):
+        """Remove the socket of a daemon that didn't exit cleanly."""
+        if not os.path.exists(self.path):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            os.unlink(self.path)
+        else:
+            exit("Box daemon already running on: " + self.path)
+        finally:
+            sock.close()
+
+    async def _serve(self):
+        """Listen on the socket."""
+        self._write_lock = asyncio.Lock()
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        print("Box daemon listening on: " + self.path)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        """Answer the requests of a client until it disconnects."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self._answer(line, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, line, writer):
+        """Answer one request."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be an object")
+            method = request["method"]
+            args = request.get("args", [])
+            if not isinstance(method, str):
+                raise ValueError("method must be a string")
+            if not isinstance(args, list):
+                raise ValueError("args must be a list")
+        except (ValueError, KeyError, TypeError) as error:
+            writer.write(encode({"error": "bad request: {}".format(error)}))
+            await writer.drain()
+            return
+
+        if method in STREAMS:
+            await self._stream(method, args, writer)
+        elif method in CALLS:
+            if method in WRITES:
+                async with self._write_lock:
+                    message = await self._call(method, args)
+            else:
+                message = await self._call(method, args)
+            writer.write(encode(message))
+        else:
+            writer.write(encode({"error": "unknown method: " + method}))
+        await writer.drain()
+
+    async def _call(self, method, args):
+        """Run a method in a worker thread, return the answer."""
+        def call():
+            try:
+                return {"result": getattr(self._facade, method)(*args)}
+            except (Exception, SystemExit) as error:
+                return {"error": str(error)}
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, call)
+
+    async def _stream(self, method, args, writer):
+        """Send the rows of a method as a worker thread yields them.
+
+        The thread waits for a slow client, see aio.iter_in_thread.
+        """
+        def messages():
+            rows = getattr(self._facade, method)(*args)
+            if isinstance(rows, Rows):
+                yield {"columns": rows.columns}
+            for row in rows:
+                yield {"row": row}
+
+        stream = iter_in_thread(self._executor, messages)
+        try:
+            async for message in stream:
+                writer.write(encode(message))
+                await writer.drain()
+            writer.write(encode({"done": True}))
+        except ConnectionError:
+            raise
+        except (Exception, SystemExit) as error:
+            writer.write(encode({"error": str(error)}))
+        finally:
+            await stream.aclose()
@@ -0,0 +1,203 @@
+"""Instrumentation of commands, see the --profile and --trace options.
+
+Phases of a command, the sql statements run through DatabaseManager and
+the python functions called by sqlite are timed. sqlite reports every
+statement it runs, triggers included, which are counted.
+"""
+
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+# characters of a statement kept in the report
+SQL_WIDTH = 200
+
+
+def normalize(sql):
+    """Return a statement in one line, cut to SQL_WIDTH."""
+    return " ".join(sql.split())[:SQL_WIDTH]
+
+
+class TimedCursor(object):
+    """Cursor adding the time spent reading its rows to its statement."""
+
+    def __init__(self, tracer, sql, cursor):
+        """Constructor."""
+        self._tracer = tracer
+        self._sql = sql
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        """Delegate to the cursor."""
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        """Iterate the rows."""
+        return self
+
+    def __next__(self):
+        """Return the next row."""
+        start = time.perf_counter()
+        row = None
+        try:
+            row = next(self._cursor)
+        finally:
+            self._tracer.add_statement(self._sql,
+                                       time.perf_counter() - start,
+                                       row is not None, calls=0)
+        return row
+
+    def fetchone(self):
+        """Return the next row, None if there are no more."""
+        return next(self, None)
+
+    def fetchall(self):
+        """Return the remaining rows."""
+        return list(self)
+
+
+class Tracer(object):
+    """Collects timings, it does nothing until it's enabled."""
+
+    def __init__(self):
+        """Constructor."""
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget what was collected."""
+        # name: [calls, seconds]
+        self.phases = {}
+        self.callbacks = {}
+        # sql: [calls, seconds, rows]
+        self.statements = {}
+        # sql: calls
+        self.sqlite_statements = {}
+
+    def enable(self):
+        """Start collecting."""
+        self.enabled = True
+
+    def add_phase(self, name, seconds):
+        """Add the time of a phase."""
+        with self._lock:
+            phase = self.phases.setdefault(name, [0, 0.0])
+            phase[0] += 1
+            phase[1] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Time the block as a phase of the command."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_statement(self, sql, seconds, rows, calls=1):
+        """Add the time and rows of a statement."""
+        sql = normalize(sql)
+        with self._lock:
+            statement = self.statements.setdefault(sql, [0, 0.0, 0])
+            statement[0] += calls
+            statement[1] += seconds
+            statement[2] += rows
+
+    def execute(self, function, sql, *args):
+        """Return function(sql, *args), timed as the statement sql.
+
+        Returned cursors are timed while their rows are read.
+        """
+        start = time.perf_counter()
+        try:
+            result = function(sql, *args)
+        finally:
+            self.add_statement(sql, time.perf_counter() - start, 0)
+        if hasattr(result, "fetchone"):
+            return TimedCursor(self, sql, result)
+        return result
+
+    def callback(self, name, function):
+        """Return function counting and timing its calls."""
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                seconds = time.perf_counter() - start
+                with self._lock:
+                    callback = self.callbacks.setdefault(name, [0, 0.0])
+                    callback[0] += 1
+                    callback[1] += seconds
+        return timed
+
+    def statement_started(self, sql):
+        """Count a statement sqlite runs, set as its trace callback."""
+        sql = normalize(sql)
+        with self._lock:
+            self.sqlite_statements[sql] = (
+                self.sqlite_statements.get(sql, 0) + 1)
+
+    def report(self, command, seconds):
+        """Return what was collected as a dict."""
+        def timings(items):
+            return {name: {"calls": calls, "ms": round(seconds * 1000, 3)}
+                    for name, (calls, seconds) in items}
+
+        statements = sorted(self.statements.items(),
+                            key=lambda item: -item[1][1])
+        return {
+            "command": command,
+            "total_ms": round(seconds * 1000, 3),
+            "phases": timings(self.phases.items()),
+            "statements": [{"sql": sql, "calls": calls,
+                            "ms": round(seconds * 1000, 3), "rows": rows}
+                           for sql, (calls, seconds, rows) in statements],
+            "sqlite_statements": self.sqlite_statements,
+            "callbacks": timings(self.callbacks.items()),
+        }
+
+    @staticmethod
+    def summary(report):
+        """Yield the lines of a readable report."""
+        yield "box profile: {} in {:.1f} ms".format(report["command"],
+                                                    report["total_ms"])
+        yield "phases:"
+        for name, timing in report["phases"].items():
+            yield "  {:<24}{:>10.1f} ms{:>6}x".format(name, timing["ms"],
+                                                      timing["calls"])
+        yield "statements:"
+        for statement in report["statements"]:
+            yield "  {:>10.1f} ms{:>6}x{:>8} rows  {}".format(
+                statement["ms"], statement["calls"], statement["rows"],
+                statement["sql"][:60])
+        for name, timing in report["callbacks"].items():
+            yield "{} callback: {} calls, {:.1f} ms".format(
+                name, timing["calls"], timing["ms"])
+        yield "sqlite ran {} statements, {} distinct".format(
+            sum(report["sqlite_statements"].values()),
+            len(report["sqlite_statements"]))
+
+    def emit(self, command, seconds, output):
+        """Print a summary to stderr, or write a json trace to output.
+
+        output is a path, or "-" or "1" for the summary.
+        """
+        report = self.report(command, seconds)
+        if output in ("-", "1"):
+            for line in self.summary(report):
+                print(line, file=sys.stderr)
+        else:
+            import json
+
+            with open(output, "w") as trace_file:
+                json.dump(report, trace_file, indent=2)
+
+
+TRACER = Tracer()
@@ -1,40 +1,140 @@
 """Utility functions."""
 
+import csv
+import io
+import json
+from itertools import chain, islice
 from os import makedirs
 from os.path import isdir
+from textwrap import indent
 
+from rows import Rows
 
-def col_max_len(d_list, k):
-    """Return max len of a key of a list of dictionaries."""
-    len_list = [len(str(d[k])) for d in d_list]
-    len_list.append(len(str(k)))
-    return max(len_list)
+# joins the tags of a file, tags can't hold it as they're typed words
+TAG_SEPARATOR = "\x1f"
 
 
-def format_dict_list(d_list, padding=4, separator=True, separator_char="-"):
+def format_dict_list(d_list, padding=4, separator=True, separator_char="-",
+                     columns=None, max_width=None):
     """Create a table from a list of dictionaries."""
-    max_len = {k: col_max_len(d_list, k) for k in d_list[0].keys()}
+    lines = iter_table(d_list, padding, separator, separator_char,
+                       sample_size=None, columns=columns, max_width=max_width)
+    return "".join(line + "\n" for line in lines)
 
-    title = ""
-    for key in d_list[0].keys():
-        title += "{key:{v_len}s}".format(key=key, v_len=max_len[key] + padding)
-    title += "\n"
 
-    separator = (separator_char * len(title)) + "\n"
+def truncate(text, width, ellipsis="..."):
+    """Cut text to width marking the cut with an ellipsis."""
+    if len(text) <= width:
+        return text
+    if width <= len(ellipsis):
+        return text[:width]
+    return text[:width - len(ellipsis)] + ellipsis
 
-    body = ""
-    for d in d_list:
-        for key in d.keys():
-            body += "{value:{v_len}s}".format(value=str(d[key]),
-                                              v_len=max_len[key] + padding)
-        body += "\n"
 
+def fit_widths(widths, max_width, min_width=3):
+    """Shrink the widest columns until their sum fits in max_width."""
+    widths = list(widths)
+    excess = sum(widths) - max_width
+    while excess > 0:
+        widest = max(range(len(widths)), key=widths.__getitem__)
+        if widths[widest] <= min_width:
+            break
+        widths[widest] -= 1
+        excess -= 1
+    return widths
+
+
+def parse_ids(tokens):
+    """Yield file ids from tokens like "12" or ranges like "10-20"."""
+    for token in tokens:
+        start, sep, end = token.partition("-")
+        try:
+            start = int(start)
+            end = int(end) if sep else start
+        except ValueError:
+            raise ValueError("invalid id or range: " + token)
+        for file_id in range(start, end + 1):
+            yield file_id
+
+
+def cell(value):
+    """Return a value as table text, lists like tags comma separated."""
+    if isinstance(value, list):
+        return ", ".join(str(item) for item in value)
+    return str(value)
+
+
+def iter_table(rows, padding=4, separator=True, separator_char="-",
+               sample_size=100, columns=None, max_width=None):
+    """Yield the lines of a table built from Rows or dictionaries.
+
+    Column widths are computed from the first sample_size rows only (all
+    of them if None), so the rest are rendered as they arrive and values
+    that don't fit are truncated. columns selects and orders the keys,
+    max_width shrinks the widest columns until the table fits in it.
+    """
+    if not isinstance(rows, Rows):
+        rows = Rows.from_dicts(rows)
+    if columns:
+        rows = rows.select(columns)
+    keys = rows.columns
+    rows = iter(rows)
+    sample = list(islice(rows, sample_size))
+    if not sample:
+        return
+
+    widths = [max([len(str(k))] + [len(cell(row[i])) for row in sample])
+              for i, k in enumerate(keys)]
+    if max_width:
+        widths = fit_widths(widths, max_width - padding * len(keys))
+
+    def line(values):
+        return "".join(truncate(cell(value), width).ljust(width + padding)
+                       for value, width in zip(values, widths))
+
+    title = line(keys)
+    yield title
     if separator:
-        result = title + separator + body
+        yield separator_char * len(title)
+
+    for row in chain(sample, rows):
+        yield line(row)
+
+
+def write_rows(rows, stream, fmt="table", columns=None, max_width=None):
+    """Write Rows or dictionaries as a table, json or json lines."""
+    if not isinstance(rows, Rows):
+        rows = Rows.from_dicts(rows)
+    if columns:
+        rows = rows.select(columns)
+
+    if fmt == "jsonl":
+        for line in rows.iter_json():
+            stream.write(line + "\n")
+    elif fmt == "json":
+        # json.dumps(list(rows), indent=2), lists like tags on one line
+        stream.write("[")
+        first = True
+        for item in rows.iter_json(indent=2):
+            stream.write("\n" if first else ",\n")
+            stream.write(indent(item, "  "))
+            first = False
+        stream.write("]\n" if first else "\n]\n")
     else:
-        result = title + body
+        for line in iter_table(rows, max_width=max_width):
+            stream.write(line + "\n")
+
 
-    return result
+def dumps_rows(rows):
+    """Return Rows or dictionaries as a json list, see write_rows."""
+    stream = io.StringIO()
+    write_rows(rows, stream, "json")
+    return stream.getvalue()[:-1]
+
+
+def split_tags(tags):
+    """Return the list of tags joined by TAG_SEPARATOR in a found file."""
+    return tags.split(TAG_SEPARATOR) if tags else []
 
 
 def mkdir_if_not_exists(folder, verbose_mode=False):
@@ -43,3 +143,71 @@ def mkdir_if_not_exists(folder, verbose_mode=False):
         makedirs(folder)
         if verbose_mode:
             print("Created {}".format(folder))
+
+
+def chunks(iterable, size):
+    """Yield lists of at most size elements from an iterable."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def read_records(stream, fmt):
+    """Yield file records from a csv or json lines stream.
+
+    Records are dicts with name, category, description and tags keys,
+    "desc" is accepted as description. In csv tags are space separated.
+    Raise ValueError with the line number of an invalid record.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        rows = ((reader.line_num, row) for row in reader)
+    else:
+        rows = _json_lines(stream)
+
+    for line, row in rows:
+        try:
+            yield _record(row)
+        except ValueError as error:
+            raise ValueError("line {}: {}".format(line, error)) from None
+
+
+def _json_lines(stream):
+    """Yield the line numbers and values of a json lines stream."""
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError as error:
+            raise ValueError("line {}: {}".format(line, error)) from None
+
+
+def _record(row):
+    """Return a file record from a csv or json row, checking its types."""
+    if not isinstance(row, dict):
+        raise ValueError("expected an object, got {}".format(
+            json.dumps(row)))
+    record = {
+        "name": row.get("name"),
+        "category": row.get("category"),
+        "description": row.get("description", row.get("desc")) or None,
+    }
+    for key, value in record.items():
+        if value is not None and not isinstance(value, str):
+            raise ValueError("{} must be a string, got {}".format(
+                key, json.dumps(value)))
+    if not record["name"] or not record["category"]:
+        raise ValueError("record without name or category")
+
+    tags = row.get("tags") or []
+    if isinstance(tags, str):
+        tags = tags.split()
+    if not isinstance(tags, list) or not all(
+            isinstance(tag, str) for tag in tags):
+        raise ValueError("tags must be a list of strings, got {}".format(
+            json.dumps(tags)))
+    record["tags"] = tags
+    return record
@@ -0,0 +1,73 @@
+"""Categories and tags saved next to the database for shell completion."""
+
+import os
+
+from config import ConfigManager
+
+# files of the vocabulary and the counter tables they're rebuilt from
+TABLES = {"categories": "category_counts", "tags": "tag_counts"}
+
+
+class Vocabulary(object):
+    """Every category and tag, in files of one name per line.
+
+    Completion scripts read them without starting python or opening the
+    database. New names are appended as they're written, removals write
+    the files again from the counter tables. They're only a cache, so
+    failing to write them doesn't fail the command.
+    """
+
+    def __init__(self, folder=None):
+        """Constructor."""
+        self._folder = folder
+
+    @property
+    def folder(self):
+        """Folder of the files, next to the current database."""
+        return self._folder or os.path.join(
+            ConfigManager().database_folder, "vocabulary")
+
+    def path(self, kind):
+        """Return the path of the categories or tags file."""
+        return os.path.join(self.folder, kind)
+
+    def add(self, db, categories=(), tags=()):
+        """Append the names that aren't in the files yet.
+
+        Missing files are built from the database instead.
+        """
+        try:
+            for kind, names in (("categories", categories), ("tags", tags)):
+                if not names:
+                    continue
+                try:
+                    with open(self.path(kind), encoding="utf-8") as words:
+                        known = set(words.read().splitlines())
+                except FileNotFoundError:
+                    self.rebuild(db)
+                    return
+                new = sorted(set(names) - known)
+                if new:
+                    with open(self.path(kind), "a", encoding="utf-8") as words:
+                        words.write(self._lines(new))
+        except OSError:
+            pass
+
+    def rebuild(self, db):
+        """Write the files again from the counter tables."""
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            for kind, table in TABLES.items():
+                names = [row[0] for row in db.select(
+                    "SELECT name FROM {} ORDER BY name".format(table))]
+                tmp_path = self.path(kind) + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as words:
+                    words.write(self._lines(names))
+                os.replace(tmp_path, self.path(kind))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _lines(names):
+        """Return names one per line, skipping those a line can't hold."""
+        return "".join(name + "\n" for name in names if "\n" not in name)
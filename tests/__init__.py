@@ -0,0 +1,19 @@
+"""Tests of box, run with: python -m unittest discover tests
+
+The configuration is read once per process, so every test shares a
+database in a temporary home set up here, before box is imported.
+"""
+
+import os
+import sys
+import tempfile
+
+HOME = tempfile.mkdtemp(prefix="box-tests-")
+os.environ["HOME"] = HOME
+os.environ["BOX_NO_DAEMON"] = "1"
+with open(os.path.join(HOME, ".boxrc"), "w") as boxrc:
+    boxrc.write("[DEFAULT]\ndatabase_folder = {}/.box/\n"
+                "database_name = db.sqlite3\n".format(HOME))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "box"))
@@ -0,0 +1,60 @@
+"""Asyncio interface of box."""
+
+import asyncio
+import unittest
+
+import tests  # noqa: F401, sets up the home before box is imported
+
+from aio import AsyncBox, BoxError
+from config import ConfigManager
+from facade import Facade
+
+
+class AsyncBoxTest(unittest.TestCase):
+    """Coroutines return python objects and raise BoxError."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Add files to find."""
+        Facade().init()
+        for i in range(5):
+            Facade().add_file("async {}".format(i), "Async", None, ["aio"])
+
+    def run_box(self, use):
+        """Run a coroutine using a box, return its result."""
+        async def main():
+            async with AsyncBox(workers=2, queue_size=1) as box:
+                return await use(box)
+
+        return asyncio.run(main())
+
+    def test_errors(self):
+        """Sql and value errors of the facade raise BoxError."""
+        with self.assertRaises(BoxError):
+            self.run_box(lambda box: box.select("SELECT * FROM missing"))
+        with self.assertRaises(BoxError):
+            self.run_box(lambda box: box.find(tags=["aio"],
+                                              order_by="missing"))
+
+    def test_iter_find(self):
+        """Found files stream until the consumer leaves."""
+        async def first_two(box):
+            names = []
+            stream = box.iter_find(category="Async", order_by="name")
+            async for found in stream:
+                names.append(found["name"])
+                if len(names) == 2:
+                    break
+            await stream.aclose()
+            return names
+
+        self.assertEqual(self.run_box(first_two), ["async 0", "async 1"])
+
+    def test_connections_not_persistent(self):
+        """The box keeps the connections of its threads only."""
+        self.run_box(lambda box: box.stats())
+        self.assertFalse(ConfigManager().persistent_connection)
+
+
+if __name__ == "__main__":
+    unittest.main()
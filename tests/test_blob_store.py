@@ -0,0 +1,43 @@
+"""Store of the attached documents."""
+
+import os
+import tempfile
+import unittest
+
+import tests  # noqa: F401, sets up the home before box is imported
+
+from blob_store import BlobStore
+
+
+class LinkTest(unittest.TestCase):
+    """Documents are opened through one link folder per blob."""
+
+    def setUp(self):
+        """Store a document."""
+        home = tempfile.mkdtemp(prefix="box-blobs-")
+        self.folder = os.path.join(home, "blobs")
+        self.store = BlobStore(self.folder)
+        document = os.path.join(home, "report.txt")
+        with open(document, "w") as stream:
+            stream.write("report")
+        self.digest = self.store.put(document)[0]
+
+    def test_link_reused(self):
+        """Opening a document twice gives the same link."""
+        link = self.store.link(self.digest, "report.txt")
+        self.assertEqual(os.path.basename(link), "report.txt")
+        self.assertEqual(os.path.realpath(link),
+                         os.path.realpath(self.store.path(self.digest)))
+        self.assertEqual(self.store.link(self.digest, "report.txt"), link)
+        self.assertEqual(os.listdir(os.path.join(self.folder, "links")),
+                         [self.digest])
+
+    def test_gc_removes_links(self):
+        """Links of removed blobs are removed too."""
+        self.store.link(self.digest, "report.txt")
+        self.assertEqual(self.store.gc(set(), grace=-1)[0], 1)
+        self.assertEqual(os.listdir(os.path.join(self.folder, "links")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Sql dumps of the database."""
+
+import io
+import sqlite3
+import unittest
+
+import tests  # noqa: F401, sets up the home before box is imported
+
+from db_manager import DatabaseManager
+from facade import Facade
+from migrations import MIGRATIONS
+
+
+class DumpTest(unittest.TestCase):
+    """A dump restores into a new database."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Add files to dump."""
+        cls.facade = Facade()
+        cls.facade.init()
+        cls.facade.add_file("dumped report", "Dump", "yearly summary",
+                            ["tax return", "dump"])
+
+    def restore(self):
+        """Return a new database restored from a dump."""
+        dump = io.StringIO()
+        self.facade.write_dump(dump)
+        db = sqlite3.connect(":memory:")
+        db.executescript(dump.getvalue())
+        return db
+
+    def test_restore(self):
+        """Tables, full text indexes and schema version are restored."""
+        db = self.restore()
+        with DatabaseManager() as original:
+            for table in ("files", "file_tags", "tag_counts",
+                          "file_trigrams"):
+                sql = "SELECT * FROM {} ORDER BY 1, 2".format(table)
+                self.assertEqual(db.execute(sql).fetchall(),
+                                 list(original.select(sql)), table)
+        self.assertEqual(db.execute("PRAGMA user_version").fetchone()[0],
+                         len(MIGRATIONS))
+        found = db.execute("SELECT files.name FROM files_fts JOIN files "
+                           "ON files.id=files_fts.rowid "
+                           "WHERE files_fts MATCH 'summ*'").fetchall()
+        self.assertEqual(found, [("dumped report",)])
+        for index in ("files_fts", "documents_fts"):
+            db.execute("INSERT INTO {0}({0}) VALUES('integrity-check')"
+                       .format(index))
+
+    def test_restored_triggers(self):
+        """The restored database keeps its index up to date."""
+        db = self.restore()
+        db.execute("INSERT INTO files(name, category_name) "
+                   "VALUES ('restored later', 'Dump')")
+        found = db.execute("SELECT count(*) FROM files_fts "
+                           "WHERE files_fts MATCH 'later'").fetchone()[0]
+        self.assertEqual(found, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
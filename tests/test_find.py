@@ -0,0 +1,45 @@
+"""Finding files."""
+
+import unittest
+
+import tests  # noqa: F401, sets up the home before box is imported
+
+from facade import Facade
+
+
+class FindTest(unittest.TestCase):
+    """Finds report bad filters and page through the files."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Add files to find."""
+        cls.facade = Facade()
+        cls.facade.init()
+        for i in range(4):
+            cls.facade.add_file("found {}".format(i), "Find", None,
+                                ["page"])
+
+    def test_invalid_regex(self):
+        """An invalid tag regex exits with an error, not a traceback."""
+        for find in (self.facade.find_rows, self.facade.facets):
+            with self.assertRaises(SystemExit) as raised:
+                find(None, None, None, ["("], tag_mode="regex")
+            self.assertIn("ERROR: invalid regex (", str(raised.exception))
+
+    def test_pages(self):
+        """Pages follow each other and the last one has no cursor."""
+        found, after = [], None
+        while True:
+            page, after = self.facade.find_page(
+                None, "Find", None, None, 2, after=after)
+            found.extend(row["name"] for row in page)
+            if after is None:
+                break
+            self.assertEqual(len(page), 2)
+        self.assertEqual(found, ["found {}".format(i) for i in range(4)])
+        with self.assertRaises(SystemExit):
+            self.facade.find_page(None, "Find", None, None, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Imports of files from csv and json lines."""
+
+import io
+import unittest
+
+import tests  # noqa: F401, sets up the home before box is imported
+
+from facade import Facade
+
+
+class ImportTest(unittest.TestCase):
+    """Invalid records stop an import with their line number."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up the database."""
+        cls.facade = Facade()
+        cls.facade.init()
+
+    def assertInvalid(self, text, message, fmt="jsonl", batch_size=1000):
+        """Check an import fails with a message."""
+        with self.assertRaises(ValueError) as raised:
+            self.facade.import_files(io.StringIO(text), fmt, batch_size)
+        self.assertIn(message, str(raised.exception))
+
+    def test_wrong_types(self):
+        """Records that aren't objects of strings are refused."""
+        self.assertInvalid('{"name": "a", "category": "C"}\n[1, 2]\n',
+                           "line 2: expected an object")
+        self.assertInvalid('{"name": 5, "category": "C"}\n',
+                           "line 1: name must be a string")
+        self.assertInvalid('{"name": "a", "category": "C", "tags": [1]}\n',
+                           "line 1: tags must be a list of strings")
+        self.assertInvalid('\n{"name": "a",\n', "line 2:")
+        self.assertInvalid("name,category\nok,C\n,C\n",
+                           "line 3: record without name or category", "csv")
+
+    def test_committed_batches(self):
+        """The error tells how many files earlier batches imported."""
+        self.assertInvalid('{"name": "imported 1", "category": "C"}\n'
+                           '{"name": "imported 2", "category": "C"}\n'
+                           '{"name": "imported 3", "category": "C"}\n'
+                           '{"name": "imported 4"}\n',
+                           "(2 files imported before it)", batch_size=2)
+        found = self.facade.find_rows("imported", None, None, None)
+        self.assertEqual([row["name"] for row in found.dicts()],
+                         ["imported 1", "imported 2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
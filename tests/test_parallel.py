@@ -0,0 +1,80 @@
+"""Selects split in ranges of file ids."""
+
+import json
+import unittest
+
+import tests  # noqa: F401, sets up the home before box is imported
+
+import parallel
+
+from facade import Facade
+
+
+class SplitSelectTest(unittest.TestCase):
+    """Split selects give the rows of the whole select."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Add files sharing names across the ranges."""
+        cls.facade = Facade()
+        cls.facade.init()
+        for i in range(40):
+            cls.facade.add_file("split {}".format(i % 10), "Split",
+                                None, ["t{}".format(i % 3)])
+
+    def assertSameRows(self, sql):
+        """Check a select gives the same rows with several workers."""
+        whole = self.facade.execute(sql, True)
+        for workers in (2, 4):
+            split = self.facade.execute(sql, True, workers)
+            self.assertEqual(sorted(map(str, json.loads(split))),
+                             sorted(map(str, json.loads(whole))))
+            rows = self.facade.execute_rows(sql, workers)
+            self.assertEqual(sorted(map(str, rows.dicts())),
+                             sorted(map(str, json.loads(whole))))
+        return json.loads(whole)
+
+    def test_self_join(self):
+        """Files pair with files of other ranges."""
+        rows = self.assertSameRows(
+            "SELECT a.id FROM files a JOIN files b "
+            "ON a.name=b.name AND a.id<>b.id")
+        self.assertGreaterEqual(len(rows), 40)
+
+    def test_subquery(self):
+        """A subquery over files sees every file."""
+        self.assertSameRows(
+            "SELECT id FROM files WHERE id IN "
+            "(SELECT id + 1 FROM files WHERE name LIKE 'split%')")
+        self.assertSameRows(
+            "SELECT name FROM tags WHERE name IN "
+            "(SELECT tag_name FROM file_tags JOIN files ON id=file_id)")
+
+    def test_whole_queries(self):
+        """Aggregates, sorting and limits apply to all the files."""
+        for sql in ("SELECT count(*) FROM files",
+                    "SELECT name FROM files ORDER BY name LIMIT 3",
+                    "SELECT category_name, count(*) FROM files GROUP BY 1"):
+            self.assertSameRows(sql)
+
+    def test_splittable(self):
+        """Selects reading files once are still split."""
+        db = parallel.read_only_connection()
+        try:
+            for sql in ("SELECT * FROM files",
+                        "SELECT * FROM files WHERE name = 'split 1'",
+                        "SELECT f.id, tag_name FROM file_tags "
+                        "JOIN files f ON f.id=file_id"):
+                self.assertTrue(parallel.splittable(db, sql), sql)
+            for sql in ("SELECT a.id FROM files a JOIN files b "
+                        "ON a.name=b.name",
+                        "SELECT * FROM tags WHERE name IN "
+                        "(SELECT category_name FROM files)",
+                        "SELECT * FROM tags"):
+                self.assertFalse(parallel.splittable(db, sql), sql)
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()